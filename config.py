@@ -4,10 +4,45 @@ Configuration management for Gotcha Guardian Payment Server
 Handles environment variables, validation, and application settings
 """
 
+from __future__ import annotations
+
 import os
-from dataclasses import dataclass
-from typing import List, Optional
-from urllib.parse import urlparse
+import re
+import sys
+from functools import lru_cache
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Mapping
+from urllib.parse import ParseResult, urlparse
+
+
+# Snapshot of the process environment, taken once at import time.
+# Config.from_env() reads from this dict instead of calling os.getenv per field.
+_ENV = dict(os.environ)
+
+# Config is a process-wide singleton: it is never compared, and the generated
+# __repr__ would print secrets, so both are skipped. slots=True needs Python 3.10+;
+# a hand-written __slots__ cannot coexist with field() defaults, so 3.9 keeps a __dict__.
+_DATACLASS_OPTIONS = {'frozen': True, 'eq': False, 'repr': False}
+if sys.version_info >= (3, 10):
+    _DATACLASS_OPTIONS['slots'] = True
+
+
+_DEFAULT_SECRET_KEY = 'dev-secret-key-change-in-production'
+
+# Validation constants, built once instead of on every validate() call
+_VALID_PAYPAL_MODES = frozenset(('sandbox', 'live'))
+# Settings that must be non-empty, in the order their errors are reported
+_REQUIRED_FIELDS = ('PAYPAL_CLIENT_ID', 'PAYPAL_CLIENT_SECRET', 'EMAIL_ADDRESS', 'EMAIL_PASSWORD', 'SMTP_SERVER')
+_LOG_LEVEL_ORDER = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+_VALID_LOG_LEVELS = frozenset(_LOG_LEVEL_ORDER)
+_EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+$')
+
+
+def refresh_env() -> None:
+    """Re-snapshot the process environment (for tests that patch os.environ)"""
+    global _ENV
+    _ENV = dict(os.environ)
 
 
 def _parse_port(port_str: str) -> int:
@@ -19,81 +54,166 @@ def _parse_port(port_str: str) -> int:
         return 5000
 
 
-@dataclass
+_TRUE_SET = frozenset(('true', '1', 'yes', 'on'))
+
+
+def _as_bool(value: str) -> bool:
+    """Parse a boolean environment value"""
+    return value.lower() in _TRUE_SET
+
+
+# Environment variable -> converter for every Config field.
+# Variables that are not set keep the dataclass field default.
+_SCHEMA = (
+    ('DATABASE_URL', str),
+    ('PAYPAL_CLIENT_ID', str),
+    ('PAYPAL_CLIENT_SECRET', str),
+    ('PAYPAL_MODE', str),
+    ('EMAIL_ADDRESS', str),
+    ('EMAIL_PASSWORD', str),
+    ('SMTP_SERVER', str),
+    ('SMTP_PORT', int),
+    ('SECRET_KEY', str),
+    ('DEBUG', _as_bool),
+    ('PORT', _parse_port),
+    ('HOST', str),
+    ('BASE_URL', str),
+    ('RATE_LIMIT_ENABLED', _as_bool),
+    ('RATE_LIMIT_DEFAULT', str),
+    ('RATE_LIMIT_PAYMENT', str),
+    ('RATE_LIMIT_DOWNLOAD', str),
+    ('RATE_LIMIT_CONTACT', str),
+    ('RATE_LIMIT_STORAGE_URI', str),
+    ('RATE_LIMIT_STRATEGY', str),
+    ('RATE_LIMIT_LOG_SAMPLE', int),
+    ('MAX_CONTENT_LENGTH', int),
+    ('UPLOAD_FOLDER', str),
+    ('LOG_LEVEL', str),
+    ('LOG_FILE', str),
+    ('LOG_MAX_BYTES', int),
+    ('LOG_BACKUP_COUNT', int),
+    ('PRODUCTS_CONFIG_FILE', str),
+    ('DOWNLOAD_EXPIRY_HOURS', int),
+    ('MAX_DOWNLOAD_ATTEMPTS', int),
+    ('DOWNLOAD_RESUME_MINUTES', int),
+)
+
+
+# String fields that are copied into several config views or compared against
+# literals; interning lets every copy share one object
+_INTERNED_FIELDS = ('PAYPAL_MODE', 'LOG_LEVEL', 'SMTP_SERVER', 'HOST', 'EMAIL_ADDRESS')
+
+
+@dataclass(**_DATACLASS_OPTIONS)
 class Config:
     """Configuration class for payment server"""
     
     # Database Configuration
-    DATABASE_URL: str = os.getenv('DATABASE_URL', 'sqlite:///payments.db')
+    DATABASE_URL: str = 'sqlite:///payments.db'
     
     # PayPal Configuration
-    PAYPAL_CLIENT_ID: str = os.getenv('PAYPAL_CLIENT_ID', '')
-    PAYPAL_CLIENT_SECRET: str = os.getenv('PAYPAL_CLIENT_SECRET', '')
-    PAYPAL_MODE: str = os.getenv('PAYPAL_MODE', 'sandbox')  # 'sandbox' or 'live'
+    PAYPAL_CLIENT_ID: str = ''
+    PAYPAL_CLIENT_SECRET: str = ''
+    PAYPAL_MODE: str = 'sandbox'  # 'sandbox' or 'live'
     
     # Email Configuration
-    EMAIL_ADDRESS: str = os.getenv('EMAIL_ADDRESS', '')
-    EMAIL_PASSWORD: str = os.getenv('EMAIL_PASSWORD', '')
-    SMTP_SERVER: str = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
-    SMTP_PORT: int = int(os.getenv('SMTP_PORT', '587'))
+    EMAIL_ADDRESS: str = ''
+    EMAIL_PASSWORD: str = ''
+    SMTP_SERVER: str = 'smtp.gmail.com'
+    SMTP_PORT: int = 587
     
     # Security Configuration
-    SECRET_KEY: str = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
+    SECRET_KEY: str = _DEFAULT_SECRET_KEY
     
     # Application Configuration
-    DEBUG: bool = os.getenv('DEBUG', 'False').lower() in ('true', '1', 'yes')
-    PORT: int = _parse_port(os.getenv('PORT', '5000'))
-    HOST: str = os.getenv('HOST', '0.0.0.0')
+    DEBUG: bool = False
+    PORT: int = 5000
+    HOST: str = '0.0.0.0'
+    BASE_URL: str = ''  # Public URL for payment and download links; empty uses the request's host
     
     # Rate Limiting Configuration
-    RATE_LIMIT_ENABLED: bool = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() in ('true', '1', 'yes')
-    RATE_LIMIT_DEFAULT: str = os.getenv('RATE_LIMIT_DEFAULT', '100 per hour')
-    RATE_LIMIT_PAYMENT: str = os.getenv('RATE_LIMIT_PAYMENT', '10 per hour')
-    RATE_LIMIT_STORAGE_URI: str = os.getenv('RATE_LIMIT_STORAGE_URI', 'memory://')  # Use Redis in production: redis://localhost:6379/0
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_DEFAULT: str = '100 per hour'
+    RATE_LIMIT_PAYMENT: str = '10 per hour'
+    RATE_LIMIT_DOWNLOAD: str = '10 per hour'
+    RATE_LIMIT_CONTACT: str = '5 per minute'
+    RATE_LIMIT_STORAGE_URI: str = 'memory://'  # Use Redis in production: redis://localhost:6379/0
+    RATE_LIMIT_STRATEGY: str = 'moving-window'  # sliding window; checked and counted atomically in Redis
+    RATE_LIMIT_LOG_SAMPLE: int = 1  # log every Nth rate-limited request; 1 logs them all
     
     # File Upload Configuration
-    MAX_CONTENT_LENGTH: int = int(os.getenv('MAX_CONTENT_LENGTH', '16777216'))  # 16MB
-    UPLOAD_FOLDER: str = os.getenv('UPLOAD_FOLDER', 'uploads')
+    MAX_CONTENT_LENGTH: int = 16777216  # 16MB
+    UPLOAD_FOLDER: str = 'uploads'
     
     # Logging Configuration
-    LOG_LEVEL: str = os.getenv('LOG_LEVEL', 'INFO')
-    LOG_FILE: str = os.getenv('LOG_FILE', './logs/payment_server.log')
-    LOG_MAX_BYTES: int = int(os.getenv('LOG_MAX_BYTES', '10485760'))  # 10MB
-    LOG_BACKUP_COUNT: int = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+    LOG_LEVEL: str = 'INFO'
+    LOG_FILE: str = './logs/payment_server.log'
+    LOG_MAX_BYTES: int = 10485760  # 10MB
+    LOG_BACKUP_COUNT: int = 5
     
     # Product Configuration
-    PRODUCTS_CONFIG_FILE: str = os.getenv('PRODUCTS_CONFIG_FILE', 'products.json')
+    PRODUCTS_CONFIG_FILE: str = 'products.json'
     
     # Download Configuration
-    DOWNLOAD_EXPIRY_HOURS: int = int(os.getenv('DOWNLOAD_EXPIRY_HOURS', '24'))
-    MAX_DOWNLOAD_ATTEMPTS: int = int(os.getenv('MAX_DOWNLOAD_ATTEMPTS', '5'))
+    DOWNLOAD_EXPIRY_HOURS: int = 24
+    MAX_DOWNLOAD_ATTEMPTS: int = 5
+    DOWNLOAD_RESUME_MINUTES: int = 60  # resumed ranges/revalidations after a counted download are free this long
+    
+    # Derived state (computed once in __post_init__)
+    _db_parsed: ParseResult | None = field(default=None, init=False, repr=False, compare=False)
+    _db_scheme: str = field(default='', init=False, repr=False, compare=False)
+    _views: dict[str, Mapping[str, Any]] = field(default_factory=dict, init=False, repr=False, compare=False)
+    
+    @classmethod
+    def from_env(cls) -> Config:
+        """Build a Config from the environment snapshot"""
+        env = _ENV
+        values = {}
+        for name, convert in _SCHEMA:
+            raw = env.get(name)
+            if raw is not None:
+                values[name] = convert(raw)
+        return cls(**values)
+    
+    def __post_init__(self):
+        """Intern shared strings, parse DATABASE_URL and build the derived config views once"""
+        for name in _INTERNED_FIELDS:
+            object.__setattr__(self, name, sys.intern(getattr(self, name)))
+        
+        # The scheme only needs a prefix split; the full urlparse is reserved
+        # for PostgreSQL URLs, whose host/port/credentials are needed
+        scheme, sep, _ = self.DATABASE_URL.partition('://')
+        parsed = None
+        if sep and scheme.startswith('postgresql'):
+            try:
+                parsed = urlparse(self.DATABASE_URL)
+                parsed.port  # raises ValueError for a malformed port
+            except ValueError:
+                parsed = None
+        object.__setattr__(self, '_db_scheme', scheme if sep else '')
+        object.__setattr__(self, '_db_parsed', parsed)
+        object.__setattr__(self, '_views', self._build_views())
     
-    def validate(self) -> List[str]:
+    def validate(self) -> list[str]:
         """Validate configuration and return list of errors"""
+        return self._collect_errors(production=False)
+    
+    def validate_production(self) -> list[str]:
+        """Additional validation for production environment"""
+        return self._collect_errors(production=True)
+    
+    def _collect_errors(self, production: bool) -> list[str]:
+        """Run all validation checks in a single pass"""
         errors = []
         
-        # Required PayPal configuration
-        if not self.PAYPAL_CLIENT_ID:
-            errors.append("PAYPAL_CLIENT_ID is required")
-        
-        if not self.PAYPAL_CLIENT_SECRET:
-            errors.append("PAYPAL_CLIENT_SECRET is required")
+        # Required PayPal and email configuration
+        errors.extend(f"{name} is required" for name in _REQUIRED_FIELDS if not getattr(self, name))
         
-        if self.PAYPAL_MODE not in ['sandbox', 'live']:
+        if self.PAYPAL_MODE not in _VALID_PAYPAL_MODES:
             errors.append("PAYPAL_MODE must be 'sandbox' or 'live'")
         
-        # Required email configuration
-        if not self.EMAIL_ADDRESS:
-            errors.append("EMAIL_ADDRESS is required")
-        
-        if not self.EMAIL_PASSWORD:
-            errors.append("EMAIL_PASSWORD is required")
-        
-        if not self.SMTP_SERVER:
-            errors.append("SMTP_SERVER is required")
-        
         # Validate email format
-        if self.EMAIL_ADDRESS and '@' not in self.EMAIL_ADDRESS:
+        if self.EMAIL_ADDRESS and not _EMAIL_RE.match(self.EMAIL_ADDRESS):
             errors.append("EMAIL_ADDRESS must be a valid email address")
         
         # Validate SMTP port
@@ -104,54 +224,43 @@ class Config:
         if not (1 <= self.PORT <= 65535):
             errors.append("PORT must be between 1 and 65535")
         
-        # Security validation
-        if self.SECRET_KEY == 'dev-secret-key-change-in-production' and not self.DEBUG:
+        # Security validation (production always requires a real key)
+        if self.SECRET_KEY == _DEFAULT_SECRET_KEY and (production or not self.DEBUG):
             errors.append("SECRET_KEY must be changed in production")
         
         if len(self.SECRET_KEY) < 32:
             errors.append("SECRET_KEY should be at least 32 characters long")
         
-        # Database URL validation
+        # Database URL validation (parsed once in __post_init__)
         if self.DATABASE_URL:
-            try:
-                parsed = urlparse(self.DATABASE_URL)
-                if not parsed.scheme:
-                    errors.append("DATABASE_URL must include a scheme (e.g., sqlite://, postgresql://)")
-            except Exception:
+            if not self._db_scheme:
+                errors.append("DATABASE_URL must include a scheme (e.g., sqlite://, postgresql://)")
+            elif self._db_scheme.startswith('postgresql') and self._db_parsed is None:
                 errors.append("DATABASE_URL format is invalid")
         
         # Log level validation
-        valid_log_levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
-        if self.LOG_LEVEL.upper() not in valid_log_levels:
-            errors.append(f"LOG_LEVEL must be one of: {', '.join(valid_log_levels)}")
-        
-        return errors
-    
-    def validate_production(self) -> List[str]:
-        """Additional validation for production environment"""
-        errors = self.validate()
-        
-        if self.DEBUG:
-            errors.append("DEBUG should be False in production")
+        if self.LOG_LEVEL.upper() not in _VALID_LOG_LEVELS:
+            errors.append(f"LOG_LEVEL must be one of: {', '.join(_LOG_LEVEL_ORDER)}")
         
-        if self.PAYPAL_MODE != 'live':
-            errors.append("PAYPAL_MODE should be 'live' in production")
-        
-        if self.SECRET_KEY == 'dev-secret-key-change-in-production':
-            errors.append("SECRET_KEY must be changed in production")
+        if production:
+            if self.DEBUG:
+                errors.append("DEBUG should be False in production")
+            
+            if self.PAYPAL_MODE != 'live':
+                errors.append("PAYPAL_MODE should be 'live' in production")
         
         return errors
     
-    def get_database_config(self) -> dict:
-        """Get database configuration dictionary"""
-        if self.DATABASE_URL.startswith('sqlite'):
-            return {
+    def _build_views(self) -> dict[str, Mapping[str, Any]]:
+        """Build the read-only configuration views returned by the get_*_config() methods"""
+        if self._db_scheme.startswith('sqlite'):
+            database = {
                 'engine': 'sqlite',
                 'database': self.DATABASE_URL.replace('sqlite:///', '').replace('sqlite://', '')
             }
-        elif self.DATABASE_URL.startswith('postgresql'):
-            parsed = urlparse(self.DATABASE_URL)
-            return {
+        elif self._db_parsed is not None:
+            parsed = self._db_parsed
+            database = {
                 'engine': 'postgresql',
                 'host': parsed.hostname,
                 'port': parsed.port or 5432,
@@ -160,36 +269,64 @@ class Config:
                 'password': parsed.password
             }
         else:
-            return {'engine': 'sqlite', 'database': 'payments.db'}
+            database = {'engine': 'sqlite', 'database': 'payments.db'}
+        
+        views = {
+            'database': database,
+            'smtp': {
+                'server': self.SMTP_SERVER,
+                'port': self.SMTP_PORT,
+                'username': self.EMAIL_ADDRESS,
+                'password': self.EMAIL_PASSWORD,
+                'use_tls': True
+            },
+            'email': {
+                'smtp_server': self.SMTP_SERVER,
+                'smtp_port': self.SMTP_PORT,
+                'username': self.EMAIL_ADDRESS,
+                'password': self.EMAIL_PASSWORD,
+                'from_email': self.EMAIL_ADDRESS,
+                'use_tls': True
+            },
+            'paypal': {
+                'mode': self.PAYPAL_MODE,
+                'client_id': self.PAYPAL_CLIENT_ID,
+                'client_secret': self.PAYPAL_CLIENT_SECRET
+            },
+            'log': {
+                'level': self.LOG_LEVEL,
+                'file': self.LOG_FILE,
+                'max_bytes': self.LOG_MAX_BYTES,
+                'backup_count': self.LOG_BACKUP_COUNT
+            },
+            'app': {
+                'debug': self.DEBUG,
+                'port': self.PORT,
+                'host': self.HOST,
+                'secret_key': self.SECRET_KEY,
+                'download_directory': 'downloads',
+                'upload_folder': self.UPLOAD_FOLDER,
+                'max_content_length': self.MAX_CONTENT_LENGTH,
+                'base_url': f"http://{self.HOST}:{self.PORT}"
+            }
+        }
+        return {name: MappingProxyType(view) for name, view in views.items()}
     
-    def get_smtp_config(self) -> dict:
+    def get_database_config(self) -> Mapping[str, Any]:
+        """Get database configuration dictionary"""
+        return self._views['database']
+    
+    def get_smtp_config(self) -> Mapping[str, Any]:
         """Get SMTP configuration dictionary"""
-        return {
-            'server': self.SMTP_SERVER,
-            'port': self.SMTP_PORT,
-            'username': self.EMAIL_ADDRESS,
-            'password': self.EMAIL_PASSWORD,
-            'use_tls': True
-        }
+        return self._views['smtp']
     
-    def get_email_config(self) -> dict:
+    def get_email_config(self) -> Mapping[str, Any]:
         """Get email configuration dictionary"""
-        return {
-            'smtp_server': self.SMTP_SERVER,
-            'smtp_port': self.SMTP_PORT,
-            'username': self.EMAIL_ADDRESS,
-            'password': self.EMAIL_PASSWORD,
-            'from_email': self.EMAIL_ADDRESS,
-            'use_tls': True
-        }
+        return self._views['email']
     
-    def get_paypal_config(self) -> dict:
+    def get_paypal_config(self) -> Mapping[str, Any]:
         """Get PayPal configuration dictionary"""
-        return {
-            'mode': self.PAYPAL_MODE,
-            'client_id': self.PAYPAL_CLIENT_ID,
-            'client_secret': self.PAYPAL_CLIENT_SECRET
-        }
+        return self._views['paypal']
     
     def is_development(self) -> bool:
         """Check if running in development mode"""
@@ -199,43 +336,30 @@ class Config:
         """Check if running in production mode"""
         return not self.DEBUG and self.PAYPAL_MODE == 'live'
     
-    def get_log_config(self) -> dict:
-        """Get logging configuration dictionary"""
-        return {
-            'level': self.LOG_LEVEL,
-            'file': self.LOG_FILE,
-            'max_bytes': self.LOG_MAX_BYTES,
-            'backup_count': self.LOG_BACKUP_COUNT
-        }
-    
-    def get_app_config(self) -> dict:
-        """Get application configuration dictionary"""
-        return {
-            'debug': self.DEBUG,
-            'port': self.PORT,
-            'host': self.HOST,
-            'secret_key': self.SECRET_KEY,
-            'download_directory': 'downloads',
-            'upload_folder': self.UPLOAD_FOLDER,
-            'max_content_length': self.MAX_CONTENT_LENGTH,
-            'base_url': f"http://{self.HOST}:{self.PORT}"
-        }
-    
-    def __post_init__(self):
-        """Post-initialization validation"""
-        # Ensure upload folder exists
-        if not os.path.exists(self.UPLOAD_FOLDER):
-            os.makedirs(self.UPLOAD_FOLDER, exist_ok=True)
+    def ensure_dirs(self) -> None:
+        """Create the upload and log directories used by the application"""
+        os.makedirs(self.UPLOAD_FOLDER, exist_ok=True)
         
-        # Ensure logs directory exists
         log_dir = os.path.dirname(self.LOG_FILE)
-        if log_dir and not os.path.exists(log_dir):
+        if log_dir:
             os.makedirs(log_dir, exist_ok=True)
+    
+    def get_log_config(self) -> Mapping[str, Any]:
+        """Get logging configuration dictionary"""
+        return self._views['log']
+    
+    def get_app_config(self) -> Mapping[str, Any]:
+        """Get application configuration dictionary"""
+        return self._views['app']
 
 
-def load_config() -> Config:
-    """Load and validate configuration"""
-    config = Config()
+def load_config(ensure_dirs: bool = True) -> Config:
+    """Load and validate configuration
+    
+    Pass ensure_dirs=False for validation-only use (diagnostics, tests)
+    so loading the configuration touches no files.
+    """
+    config = Config.from_env()
     
     # Validate configuration
     errors = config.validate()
@@ -251,8 +375,20 @@ def load_config() -> Config:
             print("❌ Cannot start in production with configuration errors")
             raise ValueError("Invalid configuration")
     
+    if ensure_dirs:
+        config.ensure_dirs()
+    
     return config
 
 
-# Global configuration instance
-config = load_config()
+@lru_cache(maxsize=1)
+def get_config() -> Config:
+    """Return the process-wide configuration, loading it on first use"""
+    return load_config()
+
+
+def __getattr__(name: str):
+    """Resolve the module-level ``config`` lazily (PEP 562)"""
+    if name == 'config':
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
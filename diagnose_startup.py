@@ -5,8 +5,17 @@ Diagnostic script to identify startup issues
 
 import sys
 import os
+import importlib
 import traceback
 
+BASIC_MODULES = ('flask', 'sqlite3', 'smtplib')
+SERVICE_MODULES = (
+    'src.models.database',
+    'src.services.email_service',
+    'src.services.payment_service',
+    'src.services.product_service',
+)
+
 print("=== Gotcha Guardian Payment Server Startup Diagnosis ===")
 print(f"Python version: {sys.version}")
 print(f"Working directory: {os.getcwd()}")
@@ -15,13 +24,13 @@ print()
 
 try:
     print("Step 1: Testing basic imports...")
-    import flask
-    import sqlite3
-    import smtplib
+    for name in BASIC_MODULES:
+        importlib.import_module(name)
     print("✅ Basic imports successful")
     
     print("\nStep 2: Testing config import...")
-    from config import config
+    from config import load_config
+    config = load_config(ensure_dirs=False)
     print("✅ Config import successful")
     print(f"   - Debug mode: {config.DEBUG}")
     print(f"   - PayPal mode: {config.PAYPAL_MODE}")
@@ -38,6 +47,10 @@ try:
         print("✅ Configuration validation passed")
     
     print("\nStep 4: Testing service imports...")
+    # One at a time, so a failure names the module that raised it
+    for name in SERVICE_MODULES:
+        print(f"   - {name}")
+        importlib.import_module(name)
     from src.models.database import DatabaseManager
     from src.services.email_service import EmailService
     from src.services.payment_service import PaymentService
@@ -48,7 +61,7 @@ try:
     db_manager = DatabaseManager(config)
     email_service = EmailService(config)
     payment_service = PaymentService(config, db_manager)
-    product_service = ProductService(config)
+    product_service = ProductService(config, db_manager)
     print("✅ Service initialization successful")
     
     print("\nStep 6: Testing Flask app creation...")
@@ -0,0 +1,31 @@
+# Gotcha Guardian Payment Server - Gunicorn Configuration
+# Cooperative gevent workers: PayPal, SMTP and download I/O yield instead of holding a thread
+
+import multiprocessing
+import os
+
+# Report greenlets that block the event loop (CPU-bound work in a handler)
+os.environ.setdefault('GEVENT_MONITOR_THREAD_ENABLE', 'true')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+worker_class = 'gevent'
+worker_connections = 1000
+
+# Rate limit counters in memory:// storage are per process, so extra workers
+# would multiply every limit; scale out only with a shared limiter backend
+if os.environ.get('WEB_CONCURRENCY'):
+    workers = int(os.environ['WEB_CONCURRENCY'])
+elif os.environ.get('RATE_LIMIT_STORAGE_URI', 'memory://').startswith('memory://'):
+    workers = 1
+else:
+    workers = multiprocessing.cpu_count() * 2 + 1
+
+max_requests = 1000
+max_requests_jitter = 100
+timeout = 30
+keepalive = 2
+
+loglevel = 'info'
+accesslog = '-'
+errorlog = '-'
@@ -5,30 +5,44 @@ Handles real PayPal payments, user registration, and activation key delivery
 with improved error handling, logging, validation, and security
 """
 
+# config imports nothing gevent patches, so it can decide whether to patch
+from config import config
+
+# Running this module as the server outside DEBUG serves on gevent: blocking stdlib
+# I/O (socket, ssl, time.sleep) is patched before anything else imports it, so PayPal
+# and SMTP round-trips yield to other requests instead of holding a thread. gunicorn's
+# gevent workers patch on their own; the dev server, DEBUG runs and the tests that
+# import this module keep the plain stdlib
+monkey = None
+if __name__ == '__main__' and not config.DEBUG:
+    try:
+        from gevent import monkey
+        monkey.patch_all()
+    except ImportError:
+        # gevent not installed, fall back to the threaded development server
+        monkey = None
+
 import os
-import json
-import sqlite3
-import secrets
-import smtplib
+import atexit
+import gzip
+import hashlib
+import itertools
 import logging
-import tempfile
-import zipfile
-from datetime import datetime, timedelta
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-from logging.handlers import RotatingFileHandler
-from typing import Dict, List, Optional, Tuple
-
-from flask import Flask, request, jsonify, render_template_string, send_file
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from marshmallow import Schema, fields, ValidationError
-import paypalrestsdk
+from werkzeug.exceptions import HTTPException
 
-from config import config
 from src.models.database import DatabaseManager
 from src.services.email_service import EmailService
 from src.services.payment_service import PaymentService
@@ -50,10 +64,69 @@ except ImportError:
     # dotenv not available in production, which is fine
     pass
 
+try:
+    import orjson
+except ImportError:
+    # orjson not installed, jsonify falls back to the stdlib json module
+    orjson = None
+
+try:
+    from flask_compress import Compress
+except ImportError:
+    # Flask-Compress not installed, JSON responses are sent uncompressed
+    Compress = None
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes responses with orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response rather than decoding to
+        # str for Flask to encode again
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default),
+                                        mimetype=self.mimetype)
+
 # Initialize Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = config.SECRET_KEY
 app.config['MAX_CONTENT_LENGTH'] = config.MAX_CONTENT_LENGTH
+if orjson is not None:
+    app.json = ORJSONProvider(app)
+
+# Compress JSON responses on the fly. The landing page already has a pre-gzipped
+# copy and product archives are already deflated, so neither is listed here
+if Compress is not None:
+    app.config['COMPRESS_MIMETYPES'] = ['application/json']
+    app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+    app.config['COMPRESS_LEVEL'] = 4
+    app.config['COMPRESS_BR_LEVEL'] = 4
+    app.config['COMPRESS_MIN_SIZE'] = 512
+    Compress(app)
+
+# site.html is read once at startup. Plain HTML is served as-is (with a gzipped
+# copy for clients that accept it); only a page with Jinja markers is compiled
+_INDEX_TEMPLATE = None
+_INDEX_BYTES_GZ = None
+_INDEX_ETAG = None
+try:
+    with open('site.html', 'rb') as f:
+        _INDEX_BYTES = f.read()
+except FileNotFoundError:
+    _INDEX_BYTES = None
+else:
+    if b'{{' in _INDEX_BYTES or b'{%' in _INDEX_BYTES:
+        _INDEX_TEMPLATE = app.jinja_env.from_string(_INDEX_BYTES.decode('utf-8'))
+    else:
+        _INDEX_BYTES_GZ = gzip.compress(_INDEX_BYTES, compresslevel=9)
+        # Content hash, so repeat visits revalidate with a 304 instead of a full body
+        _INDEX_ETAG = hashlib.sha256(_INDEX_BYTES).hexdigest()[:32]
 
 # Setup CORS
 CORS(app, origins=['*'], methods=['GET', 'POST', 'OPTIONS'])
@@ -64,11 +137,28 @@ if config.RATE_LIMIT_ENABLED:
         key_func=get_remote_address,
         app=app,
         default_limits=[config.RATE_LIMIT_DEFAULT],
-        storage_uri=config.RATE_LIMIT_STORAGE_URI
+        storage_uri=config.RATE_LIMIT_STORAGE_URI,
+        # With redis:// storage the moving window is checked and incremented
+        # in a single Lua script, so workers share one consistent count
+        strategy=config.RATE_LIMIT_STRATEGY
     )
 else:
     limiter = None
 
+def _rate_limit(spec: str):
+    """Apply a Flask-Limiter limit, or leave the view untouched when rate limiting is disabled"""
+    if limiter is None:
+        def decorator(f):
+            return f
+        return decorator
+    return limiter.limit(spec)
+
+def _rate_limit_exempt(f):
+    """Keep a view out of the default limits, e.g. endpoints polled by the platform"""
+    if limiter is None:
+        return f
+    return limiter.exempt(f)
+
 # Setup logging
 loggers = setup_logging(
     app_name='payment_server',
@@ -82,9 +172,13 @@ logger = loggers['app']
 # Initialize services
 db_manager = DatabaseManager(config)
 email_service = EmailService(config)
+atexit.register(email_service.close)
 payment_service = PaymentService(config, db_manager)
 product_service = ProductService(config, db_manager)
 
+# SMTP round-trips run here so handlers can respond without waiting on the mail server
+_email_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='email')
+
 # Request validation schemas
 class ContactSchema(Schema):
     name = fields.Str(required=True, validate=lambda x: len(x.strip()) > 0)
@@ -93,12 +187,32 @@ class ContactSchema(Schema):
 
 class PaymentCreateSchema(Schema):
     email = fields.Email(required=True)
-    product_id = fields.Str(required=True, validate=lambda x: x in product_service.get_available_products())
+    product_id = fields.Str(required=True, validate=lambda x: x in product_service.get_available_product_ids())
 
 class PaymentExecuteSchema(Schema):
     paymentID = fields.Str(required=True)
     payerID = fields.Str(required=True)
 
+# Schemas are stateless, so one instance of each is shared across requests
+_contact_schema = ContactSchema()
+_payment_create_schema = PaymentCreateSchema()
+_payment_execute_schema = PaymentExecuteSchema()
+
+# Static error bodies, serialized once since they never change
+_RATE_LIMIT_BODY = app.json.dumps({
+    'success': False,
+    'error': 'Rate limit exceeded. Please try again later.'
+}).encode('utf-8')
+_INTERNAL_ERROR_BODY = app.json.dumps({
+    'success': False,
+    'error': 'Internal server error. Please try again later.'
+}).encode('utf-8')
+
+# Every rate-limited request is logged unless RATE_LIMIT_LOG_SAMPLE is raised to
+# log one in every N, for deployments where a request flood would flood the log
+RATE_LIMIT_LOG_SAMPLE = max(config.RATE_LIMIT_LOG_SAMPLE, 1)
+_rate_limit_hits = itertools.count()
+
 # Error handlers
 @app.errorhandler(ValidationError)
 def handle_validation_error(e):
@@ -113,30 +227,64 @@ def handle_validation_error(e):
 @app.errorhandler(429)
 def handle_rate_limit_error(e):
     """Handle rate limit errors"""
-    logger.warning(f"Rate limit exceeded: {get_remote_address()}")
-    return jsonify({
-        'success': False,
-        'error': 'Rate limit exceeded. Please try again later.'
-    }), 429
+    if logger.isEnabledFor(logging.WARNING) and next(_rate_limit_hits) % RATE_LIMIT_LOG_SAMPLE == 0:
+        sampled = f" (logging 1 in {RATE_LIMIT_LOG_SAMPLE})" if RATE_LIMIT_LOG_SAMPLE > 1 else ""
+        logger.warning(f"Rate limit exceeded: {get_remote_address()}{sampled}")
+    return Response(_RATE_LIMIT_BODY, status=429, mimetype='application/json')
 
 @app.errorhandler(500)
 def handle_internal_error(e):
     """Handle internal server errors"""
     logger.error(f"Internal server error: {str(e)}")
-    return jsonify({
-        'success': False,
-        'error': 'Internal server error. Please try again later.'
-    }), 500
+    return Response(_INTERNAL_ERROR_BODY, status=500, mimetype='application/json')
 
 # Utility functions
+# Public links are built from BASE_URL when it is set, which is also right behind
+# a proxy; otherwise from the host the request came in on
+_BASE_URL = config.BASE_URL.rstrip('/') + '/' if config.BASE_URL else None
+
+def _external_url(path: str) -> str:
+    """Absolute URL for an app path such as 'api/download/<key>'"""
+    return f"{_BASE_URL or request.url_root}{path}"
+
+@lru_cache(maxsize=1)
+def _format_timestamp(second: int) -> str:
+    """Format a whole UNIX second as a local ISO-8601 timestamp"""
+    return datetime.fromtimestamp(second).isoformat()
+
+def _iso_now() -> str:
+    """Current local time as datetime.now().isoformat() gives it; the date and time
+    of day are formatted at most once per second, only the microseconds every call"""
+    second, micro = divmod(time.time_ns() // 1000, 1_000_000)
+    stamp = _format_timestamp(second)
+    return f"{stamp}.{micro:06d}" if micro else stamp
+
+def _send_and_log(description: str, send, *args, purchase_key: Optional[str] = None, **kwargs):
+    """Run an email send on the background pool and record the outcome"""
+    try:
+        # EmailService.send_email already retries with exponential backoff
+        if send(*args, **kwargs):
+            logger.info(f"Background email sent: {description}")
+            if purchase_key:
+                db_manager.mark_email_sent(purchase_key)
+        else:
+            logger.warning(f"Background email failed: {description}")
+    except Exception as e:
+        logger.error(f"Background email error ({description}): {str(e)}")
+
+_SENSITIVE_KEYS = frozenset(('password', 'secret', 'key'))
+
 def log_request_info():
     """Log request information for debugging"""
-    if config.DEBUG:
-        logger.debug(f"Request: {request.method} {request.path} from {get_remote_address()}")
-        if request.json:
-            # Don't log sensitive data
-            safe_data = {k: v for k, v in request.json.items() if k not in ['password', 'secret', 'key']}
-            logger.debug(f"Request data: {safe_data}")
+    # Skip all formatting and body filtering unless debug output would be emitted
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug(f"Request: {request.method} {request.path} from {get_remote_address()}")
+    body = request.get_json(silent=True)
+    if isinstance(body, dict) and body:
+        # Don't log sensitive data
+        safe_data = {k: v for k, v in body.items() if k not in _SENSITIVE_KEYS}
+        logger.debug(f"Request data: {safe_data}")
 
 def create_success_response(data: dict, message: str = "Success") -> dict:
     """Create standardized success response"""
@@ -144,7 +292,7 @@ def create_success_response(data: dict, message: str = "Success") -> dict:
         'success': True,
         'message': message,
         'data': data,
-        'timestamp': datetime.now().isoformat()
+        'timestamp': _iso_now()
     }
 
 def create_error_response(error: str, details: dict = None) -> dict:
@@ -152,64 +300,62 @@ def create_error_response(error: str, details: dict = None) -> dict:
     response = {
         'success': False,
         'error': error,
-        'timestamp': datetime.now().isoformat()
+        'timestamp': _iso_now()
     }
     if details:
         response['details'] = details
     return response
 
-# Routes
-@app.route('/')
-def index():
-    """Main page with payment interface"""
-    try:
-        log_request_info()
-        with open('site.html', 'r', encoding='utf-8') as f:
-            return render_template_string(f.read())
-    except FileNotFoundError:
-        logger.error("site.html not found")
-        return "Payment interface temporarily unavailable", 503
-    except Exception as e:
-        logger.error(f"Error loading main page: {str(e)}")
-        return "Service temporarily unavailable", 503
+# Cached health check response as (expiry time, JSON body)
+HEALTH_CACHE_TTL = 10.0
+HEALTH_PROBE_TIMEOUT = 3.0
+_health_cache: Tuple[float, Optional[bytes]] = (0.0, None)
+_health_refreshing = threading.Lock()
+_health_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='health')
+# Last probe submitted per service; a probe still running past its timeout is
+# waited on again rather than queueing another one behind it
+_health_probes: Dict[str, Future] = {}
+_health_probes_lock = threading.Lock()
 
-@app.route('/api/health')
-def health_check():
-    """Enhanced health check endpoint"""
-    try:
-        log_request_info()
-        
-        # Check services with error handling
-        db_status = False
-        email_status = False
-        paypal_status = False
-        products = []
-        
-        try:
-            db_status = db_manager.check_connection()
-        except:
-            db_status = False
-        
-        try:
-            email_status = email_service.check_connection()
-        except:
-            email_status = False
-        
-        try:
-            paypal_status = payment_service.check_connection()
-        except:
-            paypal_status = False
-        
+def _submit_probe(name: str, check) -> Future:
+    """Start a service check unless the previous one for the service is still running"""
+    with _health_probes_lock:
+        future = _health_probes.get(name)
+        if future is None or future.done():
+            future = _health_executor.submit(check)
+            _health_probes[name] = future
+        return future
+
+def _probe_all() -> Tuple[bool, bool, bool]:
+    """Run the database, email and PayPal checks in parallel"""
+    futures = [
+        _submit_probe(name, check)
+        for name, check in (('database', db_manager.check_connection),
+                            ('email', email_service.check_connection),
+                            ('paypal', payment_service.check_connection))
+    ]
+    deadline = time.monotonic() + HEALTH_PROBE_TIMEOUT
+    results = []
+    for future in futures:
         try:
-            products = list(product_service.get_available_products().keys())
-        except:
-            products = []
+            results.append(bool(future.result(timeout=max(0.0, deadline - time.monotonic()))))
+        except Exception:
+            # A failed or slow probe reports the service as disconnected
+            results.append(False)
+    return tuple(results)
+
+def _refresh_health(release: bool = False) -> bytes:
+    """Probe every service and store the serialized health response"""
+    global _health_cache
+    try:
+        # Check services concurrently; total time is the slowest probe, not the sum
+        db_status, email_status, paypal_status = _probe_all()
         
         # For Railway deployment, always return 200 if app is running
         # Services can be degraded but app should be considered healthy
         health_data = {
             'status': 'healthy',  # Always healthy if app responds
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': _iso_now(),
             'services': {
                 'database': 'connected' if db_status else 'disconnected',
                 'email': 'connected' if email_status else 'disconnected',
@@ -220,10 +366,60 @@ def health_check():
                 'debug': config.DEBUG,
                 'version': '2.0.0'
             },
-            'products': products
+            'products': list(product_service.get_available_products())
         }
         
-        return jsonify(health_data), 200
+        body = app.json.dumps(health_data).encode('utf-8')
+        _health_cache = (time.monotonic() + HEALTH_CACHE_TTL, body)
+        return body
+    finally:
+        if release:
+            _health_refreshing.release()
+
+# Routes
+@app.route('/')
+def index():
+    """Main page with payment interface"""
+    try:
+        log_request_info()
+        if _INDEX_BYTES is None:
+            logger.error("site.html not found")
+            return "Payment interface temporarily unavailable", 503
+        if _INDEX_TEMPLATE is not None:
+            return _INDEX_TEMPLATE.render()
+        
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response = Response(_INDEX_BYTES_GZ, mimetype='text/html')
+            response.headers['Content-Encoding'] = 'gzip'
+            # Each encoding is a distinct representation and needs its own tag
+            response.set_etag(f"{_INDEX_ETAG}-gz")
+        else:
+            response = Response(_INDEX_BYTES, mimetype='text/html')
+            response.set_etag(_INDEX_ETAG)
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response.make_conditional(request)
+    except Exception as e:
+        logger.error(f"Error loading main page: {str(e)}")
+        return "Service temporarily unavailable", 503
+
+@app.route('/api/health')
+@_rate_limit_exempt
+def health_check():
+    """Enhanced health check endpoint"""
+    try:
+        log_request_info()
+        
+        # Serve the last probe result; once it goes stale a single background
+        # refresh is started, so no request waits on the service probes
+        expiry, body = _health_cache
+        if body is None:
+            # Nothing to serve yet, so the first request probes inline
+            body = _refresh_health()
+        elif time.monotonic() >= expiry and _health_refreshing.acquire(blocking=False):
+            threading.Thread(target=_refresh_health, args=(True,),
+                             name='health-refresh', daemon=True).start()
+        
+        return Response(body, mimetype='application/json'), 200
         
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
@@ -231,38 +427,32 @@ def health_check():
         return jsonify({
             'status': 'healthy',
             'error': str(e),
-            'timestamp': datetime.now().isoformat()
+            'timestamp': _iso_now()
         }), 200
 
 @app.route('/api/contact', methods=['POST'])
-@limiter.limit("5 per minute") if limiter else lambda f: f
+@_rate_limit(config.RATE_LIMIT_CONTACT)
 def handle_contact():
     """Handle contact form submissions with validation"""
     try:
         log_request_info()
         
         # Validate input
-        schema = ContactSchema()
-        data = schema.load(request.get_json() or {})
-        
-        # Send contact email
-        success = email_service.send_contact_email(
-            name=data['name'],
-            email=data['email'],
-            message=data['message']
+        data = _contact_schema.load(request.get_json() or {})
+        
+        # Send contact email in the background
+        _email_pool.submit(
+            _send_and_log,
+            f"contact form from {data['email']}",
+            email_service.send_contact_form_notification,
+            data
         )
         
-        if success:
-            logger.info(f"Contact form submitted by {data['email']}")
-            return jsonify(create_success_response(
-                {},
-                "Message sent successfully. We'll get back to you soon!"
-            ))
-        else:
-            logger.error(f"Failed to send contact email from {data['email']}")
-            return jsonify(create_error_response(
-                "Failed to send message. Please try again later."
-            )), 500
+        logger.info(f"Contact form submitted by {data['email']}")
+        return jsonify(create_success_response(
+            {},
+            "Message sent successfully. We'll get back to you soon!"
+        ))
             
     except ValidationError as e:
         raise e  # Let the error handler deal with it
@@ -273,25 +463,25 @@ def handle_contact():
         )), 500
 
 @app.route('/api/create-payment', methods=['POST'])
-@limiter.limit(config.RATE_LIMIT_PAYMENT) if limiter else lambda f: f
+@_rate_limit(config.RATE_LIMIT_PAYMENT)
 def create_payment():
     """Create PayPal payment with enhanced validation"""
     try:
         log_request_info()
         
         # Validate input
-        schema = PaymentCreateSchema()
-        data = schema.load(request.get_json() or {})
+        data = _payment_create_schema.load(request.get_json() or {})
         
-        email = data['email']
+        # Normalized so later lookups by email match the stored purchase
+        email = data['email'].strip().lower()
         product_id = data['product_id']
         
         # Create payment
         payment_result = payment_service.create_payment(
             email=email,
             product_id=product_id,
-            return_url=f"{request.url_root}api/payment-success",
-            cancel_url=f"{request.url_root}api/payment-cancel"
+            return_url=_external_url('api/payment-success'),
+            cancel_url=_external_url('api/payment-cancel')
         )
         
         if payment_result['success']:
@@ -315,15 +505,14 @@ def create_payment():
         )), 500
 
 @app.route('/api/execute-payment', methods=['POST'])
-@limiter.limit(config.RATE_LIMIT_PAYMENT) if limiter else lambda f: f
+@_rate_limit(config.RATE_LIMIT_PAYMENT)
 def execute_payment():
     """Execute PayPal payment after approval"""
     try:
         log_request_info()
         
         # Validate input
-        schema = PaymentExecuteSchema()
-        data = schema.load(request.get_json() or {})
+        data = _payment_execute_schema.load(request.get_json() or {})
         
         payment_id = data['paymentID']
         payer_id = data['payerID']
@@ -334,30 +523,27 @@ def execute_payment():
         if execution_result['success']:
             # Generate activation key and create download link
             activation_key = execution_result['activation_key']
-            download_link = f"{request.url_root}api/download/{activation_key}"
+            download_link = _external_url(f"api/download/{activation_key}")
             
-            # Send activation email
-            email_sent = email_service.send_activation_email(
+            # Send activation email in the background; the response already carries the link
+            product = product_service.get_product_by_id(execution_result['product_id'])
+            _email_pool.submit(
+                _send_and_log,
+                f"activation email to {execution_result['email']}",
+                email_service.send_download_link,
                 email=execution_result['email'],
-                product_id=execution_result['product_id'],
+                product_name=product['name'] if product else execution_result['product_id'],
+                download_url=download_link,
                 activation_key=activation_key,
-                download_link=download_link
+                purchase_key=activation_key
             )
             
-            if email_sent:
-                logger.info(f"Payment executed successfully for {execution_result['email']}")
-                return jsonify(create_success_response({
-                    'activation_key': activation_key,
-                    'download_link': download_link,
-                    'email_sent': True
-                }, "Payment successful! Check your email for the activation key."))
-            else:
-                logger.warning(f"Payment successful but email failed for {execution_result['email']}")
-                return jsonify(create_success_response({
-                    'activation_key': activation_key,
-                    'download_link': download_link,
-                    'email_sent': False
-                }, "Payment successful! Email delivery failed, but you can download using the link below."))
+            logger.info(f"Payment executed successfully for {execution_result['email']}")
+            return jsonify(create_success_response({
+                'activation_key': activation_key,
+                'download_link': download_link,
+                'email_sent': 'queued'
+            }, "Payment successful! Check your email for the activation key."))
         else:
             logger.error(f"Payment execution failed: {execution_result['error']}")
             return jsonify(create_error_response(
@@ -372,88 +558,128 @@ def execute_payment():
             "Payment execution failed. Please contact support."
         )), 500
 
+def _continues_download():
+    """Whether the request resumes or revalidates an archive rather than starting it over"""
+    if request.if_none_match:
+        return True
+    ranges = request.range
+    return ranges is not None and ranges.ranges[0][0] != 0
+
 @app.route('/api/download/<activation_key>')
-@limiter.limit("10 per hour") if limiter else lambda f: f
+@_rate_limit(config.RATE_LIMIT_DOWNLOAD)
 def download_product(activation_key):
     """Download product files using activation key"""
     try:
         log_request_info()
         
         # Validate activation key format
-        if not validate_activation_key(activation_key):
+        if not validate_activation_key(activation_key)['valid']:
             logger.warning(f"Invalid activation key format: {activation_key}")
             return "Invalid activation key format", 400
         
-        # Get purchase info
-        purchase_info = db_manager.get_purchase_by_activation_key(activation_key)
+        # A resumed range or revalidation is free only shortly after a counted download
+        # and while the key is under its limit; every other GET checks the limit, counts
+        # itself and returns the purchase in one statement. HEAD only reads the purchase
+        is_head = request.method == 'HEAD'
+        resumed = None
+        if not is_head and _continues_download():
+            resumed = db_manager.get_resumable_download(
+                activation_key, config.MAX_DOWNLOAD_ATTEMPTS, config.DOWNLOAD_RESUME_MINUTES
+            )
+        claimed = None
+        if not is_head and not resumed:
+            claimed = db_manager.claim_download(activation_key, config.MAX_DOWNLOAD_ATTEMPTS)
+        purchase_info = resumed or claimed or db_manager.get_purchase_by_activation_key(activation_key)
         
         if not purchase_info:
             logger.warning(f"Invalid activation key: {activation_key}")
             return "Invalid activation key", 404
         
-        # Check download limits
-        if purchase_info['download_count'] >= config.MAX_DOWNLOAD_ATTEMPTS:
+        if not is_head and not (resumed or claimed):
             logger.warning(f"Download limit exceeded for key: {activation_key}")
             return "Download limit exceeded", 403
         
-        # Create product ZIP
-        zip_path = product_service.create_product_zip(
-            product_id=purchase_info['product_id'],
-            activation_key=activation_key
-        )
+        # Collect product files up front so a missing product is a clean 404
+        # rather than a broken stream
+        product_files = list(product_service.iter_product_files(purchase_info['product_id']))
         
-        if not zip_path:
-            logger.error(f"Failed to create product ZIP for {purchase_info['product_id']}")
+        if not product_files:
+            logger.error(f"Product files not available for {purchase_info['product_id']}")
             return "Product files not available", 404
         
-        # Update download count
-        db_manager.update_download_count(activation_key)
-        
-        logger.info(f"Product downloaded: {purchase_info['product_id']} with key: {activation_key}")
-        
-        # Create secure filename
-        filename = secure_filename(
+        # Filename is stored with the purchase when its activation key is assigned
+        filename = purchase_info['download_filename'] or secure_filename(
             f"gotcha_{purchase_info['product_id']}_{activation_key[:8]}.zip"
         )
         
-        return send_file(
-            zip_path,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/zip'
+        # Cached product entries plus this key's license; the bytes are stable per key,
+        # so the response can carry an ETag and answer Range requests to resume downloads
+        chunks, etag = product_service.build_product_zip(
+            purchase_info['product_id'],
+            activation_key,
+            product_files
+        )
+        response = Response(chunks, mimetype='application/zip')
+        response.content_length = sum(len(chunk) for chunk in chunks)
+        response.set_etag(etag)
+        # The archive carries this customer's license: browsers may keep it, shared caches may not
+        response.cache_control.private = True
+        response.cache_control.max_age = 0
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.make_conditional(
+            request, accept_ranges=True, complete_length=response.content_length
+        )
+        
+        # A resumed request is still counted when the archive goes out from its first
+        # byte, e.g. a stale If-Range or ETag gets the full body
+        sends_from_start = response.status_code == 200 or (
+            response.status_code == 206 and response.content_range.start == 0
         )
+        if resumed and sends_from_start:
+            claimed = db_manager.claim_download(activation_key, config.MAX_DOWNLOAD_ATTEMPTS)
+            if not claimed:
+                logger.warning(f"Download limit exceeded for key: {activation_key}")
+                return "Download limit exceeded", 403
         
+        if claimed:
+            logger.info(f"Product downloaded: {purchase_info['product_id']} with key: {activation_key}")
+        
+        return response
+        
+    except HTTPException:
+        # e.g. 416 for a Range outside the archive
+        raise
     except Exception as e:
         logger.error(f"Download error: {str(e)}")
         return "Download error. Please contact support.", 500
 
+PURCHASES_PAGE_SIZE = 50
+PURCHASES_MAX_PAGE_SIZE = 200
+
 @app.route('/api/purchases')
-@limiter.limit("30 per hour") if limiter else lambda f: f
+@_rate_limit("30 per hour")
 def list_purchases():
     """List all purchases (admin endpoint)"""
     try:
         log_request_info()
         
         # TODO: Add admin authentication
-        purchases = db_manager.get_all_purchases()
-        
-        # Remove sensitive information
-        safe_purchases = []
-        for purchase in purchases:
-            safe_purchase = {
-                'id': purchase['id'],
-                'email': purchase['email'][:3] + '***' + purchase['email'][-10:],  # Mask email
-                'product_id': purchase['product_id'],
-                'amount': purchase['amount'],
-                'purchase_date': purchase['purchase_date'],
-                'status': purchase['status'],
-                'download_count': purchase['download_count']
-            }
-            safe_purchases.append(safe_purchase)
+        try:
+            limit = min(max(int(request.args.get('limit', PURCHASES_PAGE_SIZE)), 1), PURCHASES_MAX_PAGE_SIZE)
+            before = request.args.get('before')
+            before_id = int(before) if before else None
+        except ValueError:
+            return jsonify(create_error_response(
+                "Invalid pagination parameters"
+            )), 400
+        
+        # Email masking and column projection happen in SQL
+        purchases = db_manager.get_purchases_page(limit=limit, before_id=before_id)
         
         return jsonify(create_success_response({
-            'purchases': safe_purchases,
-            'total': len(safe_purchases)
+            'purchases': purchases,
+            'total': db_manager.count_purchases(),
+            'next_cursor': purchases[-1]['id'] if len(purchases) == limit else None
         }))
         
     except Exception as e:
@@ -463,7 +689,7 @@ def list_purchases():
         )), 500
 
 @app.route('/api/stats')
-@limiter.limit("10 per hour") if limiter else lambda f: f
+@_rate_limit("10 per hour")
 def get_stats():
     """Get basic statistics (admin endpoint)"""
     try:
@@ -503,6 +729,7 @@ def initialize_app():
         # Initialize database
         try:
             db_manager.initialize_database()
+            db_manager.configure_pool(size=10)
             logger.info("✅ Database initialized")
         except Exception as e:
             logger.warning(f"⚠️ Database initialization failed: {str(e)}")
@@ -515,7 +742,7 @@ def initialize_app():
             logger.warning(f"⚠️ Email service initialization failed: {str(e)}")
         
         try:
-            payment_service.initialize()
+            payment_service.initialize(product_service.get_available_product_ids())
             logger.info("✅ Payment service initialized")
         except Exception as e:
             logger.warning(f"⚠️ Payment service initialization failed: {str(e)}")
@@ -531,7 +758,7 @@ def initialize_app():
         logger.info(f"✅ Environment: {'Production' if config.is_production() else 'Development'}")
         logger.info(f"✅ PayPal mode: {config.PAYPAL_MODE}")
         try:
-            logger.info(f"✅ Available products: {list(product_service.get_available_products().keys())}")
+            logger.info(f"✅ Available products: {list(product_service.get_available_products())}")
         except:
             logger.warning("⚠️ Product service not available")
         logger.info(f"✅ Rate limiting: {'Enabled' if config.RATE_LIMIT_ENABLED else 'Disabled'}")
@@ -543,35 +770,21 @@ def initialize_app():
         # Still return True to allow Railway deployment
         return True
 
-# Initialize for both direct run and gunicorn
-if not initialize_app():
-    logger.error("❌ Application initialization failed")
-    if __name__ == '__main__':
-        exit(1)
-
-if __name__ == '__main__':
-    logger.info("🚀 Starting payment server in development mode...")
-    app.run(
-        debug=config.DEBUG,
-        host=config.HOST,
-        port=config.PORT,
-        threaded=True
-    )
 # Add this route after your existing routes
 @app.route('/api/config', methods=['GET'])
 def get_config():
     """Get frontend configuration"""
     try:
-        config = {
-            'paypal_client_id': os.getenv('PAYPAL_CLIENT_ID', '')
+        frontend_config = {
+            'paypal_client_id': config.PAYPAL_CLIENT_ID
         }
-        return create_success_response(config)
+        return create_success_response(frontend_config)
     except Exception as e:
         logger.error(f"Config retrieval error: {str(e)}")
         return create_error_response("Failed to retrieve configuration", 500)
 
 @app.route('/api/process-card-payment', methods=['POST'])
-@limiter.limit(config.RATE_LIMIT_PAYMENT) if limiter else lambda f: f
+@_rate_limit(config.RATE_LIMIT_PAYMENT)
 def process_card_payment():
     """Process credit/debit card payment (placeholder implementation)"""
     try:
@@ -596,6 +809,13 @@ def process_card_payment():
                     f"Missing required card field: {field}"
                 )), 400
         
+        # Reject bad addresses before writing a purchase row or queueing an email
+        email = str(data['email']).strip().lower()
+        if not validate_email(email):
+            return jsonify(create_error_response(
+                "Invalid email address"
+            )), 400
+        
         # Get product info
         products = product_service.get_available_products()
         product_id = data['product_id']
@@ -622,7 +842,7 @@ def process_card_payment():
         
         # Create purchase record
         purchase_id = db_manager.create_purchase(
-            email=data['email'],
+            email=email,
             product_id=product_id,
             amount=product_info['price'],
             paypal_payment_id=f"CARD_{activation_key}",  # Use unique identifier
@@ -638,22 +858,26 @@ def process_card_payment():
             )
             
             # Create download link
-            download_link = f"{request.url_root}api/download/{activation_key}"
+            download_link = _external_url(f"api/download/{activation_key}")
             
-            # Send activation email
-            email_sent = email_service.send_activation_email(
-                email=data['email'],
-                product_id=product_id,
+            # Send activation email in the background; the response already carries the link
+            _email_pool.submit(
+                _send_and_log,
+                f"activation email to {email}",
+                email_service.send_download_link,
+                email=email,
+                product_name=product_info['name'],
+                download_url=download_link,
                 activation_key=activation_key,
-                download_link=download_link
+                purchase_key=activation_key
             )
             
-            logger.info(f"Card payment processed successfully for {data['email']}")
+            logger.info(f"Card payment processed successfully for {email}")
             
             return jsonify(create_success_response({
                 'activation_key': activation_key,
                 'download_link': download_link,
-                'email_sent': email_sent
+                'email_sent': 'queued'
             }, "Payment successful! Check your email for the activation key."))
         else:
             logger.error(f"Failed to create purchase record for card payment")
@@ -666,3 +890,22 @@ def process_card_payment():
         return jsonify(create_error_response(
             "Payment processing failed. Please contact support."
         )), 500
+
+# Initialize for both direct run and gunicorn
+if not initialize_app():
+    logger.error("❌ Application initialization failed")
+    if __name__ == '__main__':
+        exit(1)
+
+if __name__ == '__main__':
+    if monkey is not None and not config.DEBUG:
+        from gevent.pywsgi import WSGIServer
+        logger.info("🚀 Starting payment server on gevent WSGIServer...")
+        WSGIServer((config.HOST, config.PORT), app).serve_forever()
+    else:
+        logger.info("🚀 Starting payment server in development mode...")
+        app.run(
+            debug=config.DEBUG,
+            host=config.HOST,
+            port=config.PORT
+        )
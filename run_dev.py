@@ -68,7 +68,7 @@ class DevServer:
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
                 universal_newlines=True,
-                bufsize=1
+                bufsize=-1  # block-buffered reads; readline() still yields whole lines
             )
             
             self.running = True
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+SQLite Connection Pool for Gotcha Guardian Payment Server
+Keeps read-only connections for concurrent readers and a single writer
+"""
+
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator
+
+
+class ConnectionPool:
+    """Read/write split pool of long-lived SQLite connections
+
+    With WAL journaling any number of readers can run alongside one writer,
+    so reads are spread over several read-only connections while every write
+    goes through the same connection. Writers queue on a lock here instead of
+    colliding inside SQLite and waiting out SQLITE_BUSY.
+    
+    Connections live as long as the pool, so each one's prepared statement
+    cache stays warm and hot queries skip SQLite's parse and plan step.
+    """
+
+    def __init__(self, db_path: str, read_size: int,
+                 configure: Callable[[sqlite3.Connection], None], timeout: float = 30.0,
+                 cached_statements: int = 256):
+        self.db_path = db_path
+        self.read_size = read_size
+
+        # The writer is opened first so WAL is enabled before any reader attaches
+        self._writer = sqlite3.connect(
+            db_path,
+            timeout=timeout,
+            check_same_thread=False,
+            cached_statements=cached_statements,
+            isolation_level='IMMEDIATE'  # take the write lock up front, never upgrade mid-transaction
+        )
+        configure(self._writer)
+        self._writer_lock = threading.Lock()
+
+        self._readers = queue.Queue(maxsize=read_size)
+        for _ in range(read_size):
+            reader = sqlite3.connect(
+                f"{Path(db_path).resolve().as_uri()}?mode=ro",
+                uri=True,
+                timeout=timeout,
+                check_same_thread=False,
+                cached_statements=cached_statements,
+                isolation_level=None  # autocommit; reads never hold a transaction open
+            )
+            configure(reader)
+            self._readers.put(reader)
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a read-only connection"""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        """Hold the writer connection; commits on success and rolls back on error"""
+        with self._writer_lock:
+            try:
+                yield self._writer
+                if self._writer.in_transaction:
+                    self._writer.commit()
+            except BaseException:
+                if self._writer.in_transaction:
+                    self._writer.rollback()
+                raise
+
+    def close(self):
+        """Close every connection in the pool"""
+        with self._writer_lock:
+            self._writer.close()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
@@ -12,6 +12,29 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass
 
+from .connection_pool import ConnectionPool
+
+
+# UPDATE ... RETURNING needs SQLite 3.35+
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+# Database files already switched to WAL; the journal mode is persistent, so
+# it only has to be set once per file per process
+_WAL_ENABLED_PATHS = set()
+_WAL_LOCK = threading.Lock()
+
+
+def make_download_filename(product_id: str, activation_key: str) -> str:
+    """Build the attachment filename for a purchase's download
+    
+    Registered as an SQL function on every connection so the name can be
+    stored when the activation key is assigned instead of on each download.
+    Only filename-safe characters are kept, as in security.secure_filename.
+    """
+    filename = f"gotcha_{product_id}_{activation_key[:8]}.zip"
+    return ''.join(c for c in filename if c.isalnum() or c in '._-')
+
 
 @dataclass
 class Purchase:
@@ -46,6 +69,7 @@ class DatabaseManager:
         self.logger = logging.getLogger(__name__)
         self._lock = threading.Lock()
         self._db_path = self._get_db_path()
+        self._pool: Optional[ConnectionPool] = None
         
     def _get_db_path(self) -> str:
         """Get database path from configuration"""
@@ -63,8 +87,7 @@ class DatabaseManager:
         conn = None
         try:
             conn = sqlite3.connect(self._db_path, timeout=30.0)
-            conn.row_factory = sqlite3.Row  # Enable dict-like access
-            conn.execute('PRAGMA foreign_keys = ON')  # Enable foreign key constraints
+            self._configure_connection(conn)
             yield conn
         except sqlite3.Error as e:
             if conn:
@@ -75,10 +98,69 @@ class DatabaseManager:
             if conn:
                 conn.close()
     
+    def configure_pool(self, size: int = 10) -> None:
+        """Open long-lived connections for hot-path queries: `size` readers plus one writer"""
+        if self._db_path == ':memory:':
+            # Every connection to :memory: is a separate database, so nothing can be shared
+            self.logger.info("In-memory database, connection pool not used")
+            return
+        self._pool = ConnectionPool(self._db_path, read_size=size, configure=self._configure_connection)
+        self.logger.info(f"Database connection pool ready ({size} readers, 1 writer)")
+    
+    def _configure_connection(self, conn: sqlite3.Connection) -> None:
+        """Apply the settings every connection handed out by the manager needs"""
+        conn.row_factory = sqlite3.Row  # Enable dict-like access
+        
+        # WAL lets readers run alongside the download-count writer
+        with _WAL_LOCK:
+            if self._db_path not in _WAL_ENABLED_PATHS:
+                conn.execute('PRAGMA journal_mode = WAL')
+                _WAL_ENABLED_PATHS.add(self._db_path)
+        
+        # Per-connection settings (busy waiting comes from connect(timeout=30.0))
+        conn.execute('PRAGMA synchronous = NORMAL')  # WAL is still crash-safe without a per-commit fsync
+        conn.execute('PRAGMA cache_size = -20000')  # ~20 MB page cache
+        conn.execute('PRAGMA temp_store = MEMORY')
+        # SQLite checkpoints the WAL on its own (every 1000 pages); this truncates the
+        # -wal file back to 64 MB afterwards instead of leaving it at its peak size
+        conn.execute('PRAGMA journal_size_limit = 67108864')
+        conn.execute('PRAGMA foreign_keys = ON')  # Enable foreign key constraints
+        conn.create_function('make_download_filename', 2, make_download_filename)
+    
+    @contextmanager
+    def read_conn(self):
+        """Borrow a pooled read-only connection, or open a one-off one if no pool is configured"""
+        if self._pool is None:
+            with self.get_connection() as conn:
+                yield conn
+            return
+        
+        try:
+            with self._pool.read() as conn:
+                yield conn
+        except sqlite3.Error as e:
+            self.logger.error(f"Database error: {str(e)}")
+            raise
+    
+    @contextmanager
+    def write_conn(self):
+        """Hold the pooled writer connection, or open a one-off one if no pool is configured"""
+        if self._pool is None:
+            with self.get_connection() as conn:
+                yield conn
+            return
+        
+        try:
+            with self._pool.write() as conn:
+                yield conn
+        except sqlite3.Error as e:
+            self.logger.error(f"Database error: {str(e)}")
+            raise
+    
     def check_connection(self) -> bool:
         """Check if database connection is working"""
         try:
-            with self.get_connection() as conn:
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT 1')
                 return True
@@ -105,11 +187,27 @@ class DatabaseManager:
                         status TEXT DEFAULT 'pending',
                         download_count INTEGER DEFAULT 0,
                         last_download TIMESTAMP,
+                        email_sent_at TIMESTAMP,
+                        download_filename TEXT,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 ''')
                 
+                # Add columns introduced after the original schema
+                columns = {row[1] for row in cursor.execute('PRAGMA table_info(purchases)')}
+                if 'email_sent_at' not in columns:
+                    cursor.execute('ALTER TABLE purchases ADD COLUMN email_sent_at TIMESTAMP')
+                if 'download_filename' not in columns:
+                    cursor.execute('ALTER TABLE purchases ADD COLUMN download_filename TEXT')
+                
+                # Backfill filenames for purchases keyed before the column existed
+                cursor.execute(
+                    """UPDATE purchases 
+                       SET download_filename = make_download_filename(product_id, activation_key) 
+                       WHERE download_filename IS NULL AND activation_key IS NOT NULL"""
+                )
+                
                 # Create activation_keys table
                 cursor.execute('''
                     CREATE TABLE IF NOT EXISTS activation_keys (
@@ -125,12 +223,24 @@ class DatabaseManager:
                 ''')
                 
                 # Create indexes for better performance
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_purchases_email ON purchases(email)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_purchases_activation_key ON purchases(activation_key)')
+                # (activation_key lookups on both tables use the B-tree SQLite builds for
+                # its UNIQUE constraint; a second index on the same column only slows writes)
+                # (email, purchase_date) returns a customer's purchases already in date order
+                cursor.execute('DROP INDEX IF EXISTS idx_purchases_email')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_purchases_email_date ON purchases(email, purchase_date)')
+                cursor.execute('DROP INDEX IF EXISTS idx_purchases_activation_key')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_purchases_paypal_id ON purchases(paypal_payment_id)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_purchases_status ON purchases(status)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_activation_keys_key ON activation_keys(activation_key)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_activation_keys_product ON activation_keys(product_id)')
+                # (status, purchase_date) serves status filters and the date-bounded stats and
+                # cleanup queries; it also covers plain status lookups, replacing the old index
+                cursor.execute('DROP INDEX IF EXISTS idx_purchases_status')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_purchases_status_date ON purchases(status, purchase_date)')
+                cursor.execute('DROP INDEX IF EXISTS idx_activation_keys_key')
+                # Only unused keys are ever looked up by product, oldest first
+                cursor.execute('DROP INDEX IF EXISTS idx_activation_keys_product')
+                cursor.execute(
+                    '''CREATE INDEX IF NOT EXISTS idx_activation_keys_unused 
+                       ON activation_keys(product_id, created_date) WHERE used = FALSE'''
+                )
                 
                 # Create trigger to update updated_at timestamp
                 cursor.execute('''
@@ -153,7 +263,7 @@ class DatabaseManager:
                       paypal_payment_id: str, status: str = 'pending') -> Optional[int]:
         """Create a new purchase record"""
         try:
-            with self.get_connection() as conn:
+            with self.write_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     """INSERT INTO purchases 
@@ -173,15 +283,16 @@ class DatabaseManager:
                              activation_key: Optional[str] = None) -> bool:
         """Update purchase status and activation key"""
         try:
-            with self.get_connection() as conn:
+            with self.write_conn() as conn:
                 cursor = conn.cursor()
                 
                 if activation_key:
                     cursor.execute(
                         """UPDATE purchases 
-                           SET status = ?, activation_key = ? 
+                           SET status = ?, activation_key = ?, 
+                               download_filename = make_download_filename(product_id, ?) 
                            WHERE paypal_payment_id = ?""",
-                        (status, activation_key, paypal_payment_id)
+                        (status, activation_key, activation_key, paypal_payment_id)
                     )
                 else:
                     cursor.execute(
@@ -204,10 +315,92 @@ class DatabaseManager:
             self.logger.error(f"Failed to update purchase: {str(e)}")
             return False
     
+    def update_open_purchase_status(self, paypal_payment_id: str, status: str) -> bool:
+        """Set the status of a purchase that is not completed or held for review
+        
+        Used on payment error paths, where a retried or replayed request must
+        never downgrade a purchase that already has its activation key, nor
+        write off one whose buyer may already have been charged.
+        """
+        try:
+            with self.write_conn() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """UPDATE purchases 
+                       SET status = ? 
+                       WHERE paypal_payment_id = ? 
+                         AND status NOT IN ('completed', 'pending_review')""",
+                    (status, paypal_payment_id)
+                )
+                conn.commit()
+                
+                if cursor.rowcount > 0:
+                    self.logger.info(f"Purchase updated: PayPal ID {paypal_payment_id}, Status: {status}")
+                    return True
+                return False
+                
+        except Exception as e:
+            self.logger.error(f"Failed to update purchase: {str(e)}")
+            return False
+    
+    def complete_purchase(self, paypal_payment_id: str, product_id: str,
+                          activation_key: str) -> Optional[Dict[str, Any]]:
+        """Mark a purchase completed and assign its activation key in one write
+        
+        The purchase must belong to `product_id` (the key embeds it) and must not
+        already be completed, so an existing key is never replaced. Returns the
+        purchase's id, email and product_id, or None when no purchase matched.
+        """
+        try:
+            with self.write_conn() as conn:
+                cursor = conn.cursor()
+                if _HAS_RETURNING:
+                    cursor.execute(
+                        """UPDATE purchases 
+                           SET status = 'completed', activation_key = ?, 
+                               download_filename = make_download_filename(product_id, ?) 
+                           WHERE paypal_payment_id = ? AND product_id = ? 
+                             AND status != 'completed' 
+                           RETURNING id, email, product_id""",
+                        (activation_key, activation_key, paypal_payment_id, product_id)
+                    )
+                    rows = cursor.fetchall()
+                    row = rows[0] if rows else None
+                else:
+                    # SQLite < 3.35: same update and read-back inside one write transaction
+                    cursor.execute('BEGIN IMMEDIATE')
+                    cursor.execute(
+                        """UPDATE purchases 
+                           SET status = 'completed', activation_key = ?, 
+                               download_filename = make_download_filename(product_id, ?) 
+                           WHERE paypal_payment_id = ? AND product_id = ? 
+                             AND status != 'completed'""",
+                        (activation_key, activation_key, paypal_payment_id, product_id)
+                    )
+                    row = None
+                    if cursor.rowcount > 0:
+                        cursor.execute(
+                            """SELECT id, email, product_id 
+                               FROM purchases WHERE activation_key = ?""",
+                            (activation_key,)
+                        )
+                        row = cursor.fetchone()
+                conn.commit()
+                
+                if row:
+                    self.logger.info(f"Purchase completed: PayPal ID {paypal_payment_id}")
+                    return dict(row)
+                self.logger.warning(f"No pending purchase for PayPal ID {paypal_payment_id} and product {product_id}")
+                return None
+                
+        except Exception as e:
+            self.logger.error(f"Failed to complete purchase: {str(e)}")
+            return None
+    
     def get_purchase_by_paypal_id(self, paypal_payment_id: str) -> Optional[Dict[str, Any]]:
         """Get purchase by PayPal payment ID"""
         try:
-            with self.get_connection() as conn:
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     """SELECT * FROM purchases 
@@ -227,7 +420,7 @@ class DatabaseManager:
     def get_purchase_by_activation_key(self, activation_key: str) -> Optional[Dict[str, Any]]:
         """Get purchase by activation key"""
         try:
-            with self.get_connection() as conn:
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     """SELECT * FROM purchases 
@@ -247,7 +440,7 @@ class DatabaseManager:
     def update_download_count(self, activation_key: str) -> bool:
         """Update download count and timestamp"""
         try:
-            with self.get_connection() as conn:
+            with self.write_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     """UPDATE purchases 
@@ -267,10 +460,109 @@ class DatabaseManager:
             self.logger.error(f"Failed to update download count: {str(e)}")
             return False
     
+    def claim_download(self, activation_key: str, max_attempts: int) -> Optional[Dict[str, Any]]:
+        """Atomically count a download if the purchase is under its download limit
+        
+        Returns the updated purchase row, or None when the key is unknown, the
+        purchase is not completed, or the limit has been reached. The check and
+        the increment are one statement, so concurrent downloads cannot both
+        pass the limit.
+        """
+        try:
+            with self.write_conn() as conn:
+                cursor = conn.cursor()
+                if _HAS_RETURNING:
+                    cursor.execute(
+                        """UPDATE purchases 
+                           SET download_count = download_count + 1, 
+                               last_download = CURRENT_TIMESTAMP 
+                           WHERE activation_key = ? AND status = 'completed' 
+                             AND download_count < ? 
+                           RETURNING id, email, product_id, download_count, download_filename""",
+                        (activation_key, max_attempts)
+                    )
+                    rows = cursor.fetchall()
+                    row = rows[0] if rows else None
+                else:
+                    # SQLite < 3.35: same update and read-back inside one write transaction
+                    cursor.execute('BEGIN IMMEDIATE')
+                    cursor.execute(
+                        """UPDATE purchases 
+                           SET download_count = download_count + 1, 
+                               last_download = CURRENT_TIMESTAMP 
+                           WHERE activation_key = ? AND status = 'completed' 
+                             AND download_count < ?""",
+                        (activation_key, max_attempts)
+                    )
+                    row = None
+                    if cursor.rowcount > 0:
+                        cursor.execute(
+                            """SELECT id, email, product_id, download_count, download_filename 
+                               FROM purchases WHERE activation_key = ?""",
+                            (activation_key,)
+                        )
+                        row = cursor.fetchone()
+                conn.commit()
+                
+                if row:
+                    self.logger.info(f"Download claimed for activation key: {activation_key[:8]}...")
+                    return dict(row)
+                return None
+                
+        except Exception as e:
+            self.logger.error(f"Failed to claim download: {str(e)}")
+            return None
+    
+    def get_resumable_download(self, activation_key: str, max_attempts: int,
+                               window_minutes: int) -> Optional[Dict[str, Any]]:
+        """Get a purchase whose last counted download may still be resumed uncounted
+        
+        Returns the same columns as claim_download() while the purchase is under
+        its download limit and its last download was counted within
+        window_minutes; otherwise None, and the request must be claimed.
+        """
+        try:
+            with self.read_conn() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """SELECT id, email, product_id, download_count, download_filename 
+                       FROM purchases 
+                       WHERE activation_key = ? AND status = 'completed' 
+                         AND download_count > 0 AND download_count < ? 
+                         AND last_download >= datetime('now', ?)""",
+                    (activation_key, max_attempts, f'-{int(window_minutes)} minutes')
+                )
+                row = cursor.fetchone()
+                
+                if row:
+                    return dict(row)
+                return None
+                
+        except Exception as e:
+            self.logger.error(f"Failed to get resumable download: {str(e)}")
+            return None
+    
+    def mark_email_sent(self, activation_key: str) -> bool:
+        """Record that the activation email for a purchase was delivered"""
+        try:
+            with self.write_conn() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """UPDATE purchases 
+                       SET email_sent_at = CURRENT_TIMESTAMP 
+                       WHERE activation_key = ?""",
+                    (activation_key,)
+                )
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            self.logger.error(f"Failed to record email delivery: {str(e)}")
+            return False
+    
     def get_all_purchases(self, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
         """Get all purchases with pagination"""
         try:
-            with self.get_connection() as conn:
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     """SELECT * FROM purchases 
@@ -285,10 +577,49 @@ class DatabaseManager:
             self.logger.error(f"Failed to get all purchases: {str(e)}")
             return []
     
+    def get_purchases_page(self, limit: int = 50,
+                           before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get one page of purchases, newest first, with emails masked in SQL
+        
+        Pages are keyed on the primary key (rows with id < before_id), so each
+        page is an index range scan with no sort or OFFSET skipping.
+        """
+        try:
+            with self.read_conn() as conn:
+                cursor = conn.cursor()
+                where = "WHERE id < ?" if before_id is not None else ""
+                params = (before_id, limit) if before_id is not None else (limit,)
+                cursor.execute(
+                    f"""SELECT id, 
+                               SUBSTR(email, 1, 3) || '***' || SUBSTR(email, -10) AS email, 
+                               product_id, amount, purchase_date, status, download_count 
+                        FROM purchases 
+                        {where} 
+                        ORDER BY id DESC 
+                        LIMIT ?""",
+                    params
+                )
+                # Rows go straight from the cursor into dicts, with no fetchall() list in between
+                return [dict(row) for row in cursor]
+                
+        except Exception as e:
+            self.logger.error(f"Failed to get purchases page: {str(e)}")
+            return []
+    
+    def count_purchases(self) -> int:
+        """Count every purchase row, whatever its status"""
+        try:
+            with self.read_conn() as conn:
+                return conn.execute("SELECT COUNT(*) FROM purchases").fetchone()[0]
+                
+        except Exception as e:
+            self.logger.error(f"Failed to count purchases: {str(e)}")
+            return 0
+    
     def get_purchases_by_email(self, email: str) -> List[Dict[str, Any]]:
         """Get all purchases for a specific email"""
         try:
-            with self.get_connection() as conn:
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     """SELECT * FROM purchases 
@@ -306,7 +637,7 @@ class DatabaseManager:
     def get_purchase_stats(self) -> Dict[str, Any]:
         """Get purchase statistics"""
         try:
-            with self.get_connection() as conn:
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
                 
                 # Total purchases
@@ -353,12 +684,13 @@ class DatabaseManager:
     def cleanup_old_pending_purchases(self, hours: int = 24) -> int:
         """Clean up old pending purchases"""
         try:
-            with self.get_connection() as conn:
+            with self.write_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     """DELETE FROM purchases 
                        WHERE status = 'pending' 
-                       AND purchase_date < datetime('now', '-{} hours')""".format(hours)
+                       AND purchase_date < datetime('now', ?)""",
+                    (f'-{int(hours)} hours',)
                 )
                 conn.commit()
                 deleted_count = cursor.rowcount
@@ -375,7 +707,7 @@ class DatabaseManager:
     def create_activation_key(self, product_id: str, activation_key: str) -> bool:
         """Create a pre-generated activation key"""
         try:
-            with self.get_connection() as conn:
+            with self.write_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     """INSERT INTO activation_keys (product_id, activation_key) 
@@ -390,10 +722,78 @@ class DatabaseManager:
             self.logger.error(f"Failed to create activation key: {str(e)}")
             return False
     
+    def create_activation_keys(self, product_id: str, activation_keys: List[str]) -> int:
+        """Add a batch of pre-generated activation keys in a single transaction
+        
+        One commit covers the whole batch, so loading keys costs one WAL sync
+        rather than one per key. Returns the number of keys inserted.
+        """
+        try:
+            with self.write_conn() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(
+                    """INSERT INTO activation_keys (product_id, activation_key) 
+                       VALUES (?, ?)""",
+                    [(product_id, key) for key in activation_keys]
+                )
+                conn.commit()
+                self.logger.info(f"{len(activation_keys)} activation keys created for product: {product_id}")
+                return len(activation_keys)
+                
+        except Exception as e:
+            self.logger.error(f"Failed to create activation keys: {str(e)}")
+            return 0
+
+    def top_up_activation_keys(self, product_id: str, activation_keys: List[str]) -> int:
+        """Add keys until a product has len(activation_keys) unused ones
+
+        Counting and inserting happen in one write transaction, so when several
+        workers top up the pool at once only the first inserts anything and
+        the others find it full. Returns the number of keys inserted.
+        """
+        try:
+            with self.write_conn() as conn:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute(
+                    """SELECT COUNT(*) FROM activation_keys
+                       WHERE product_id = ? AND used = FALSE""",
+                    (product_id,)
+                )
+                missing = max(len(activation_keys) - cursor.fetchone()[0], 0)
+                if missing:
+                    cursor.executemany(
+                        """INSERT INTO activation_keys (product_id, activation_key)
+                           VALUES (?, ?)""",
+                        [(product_id, key) for key in activation_keys[:missing]]
+                    )
+                conn.commit()
+                return missing
+
+        except Exception as e:
+            self.logger.error(f"Failed to top up activation keys: {str(e)}")
+            return 0
+
+    def count_unused_activation_keys(self, product_id: str) -> int:
+        """Count the pre-generated activation keys still available for a product"""
+        try:
+            with self.read_conn() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """SELECT COUNT(*) FROM activation_keys 
+                       WHERE product_id = ? AND used = FALSE""",
+                    (product_id,)
+                )
+                return cursor.fetchone()[0]
+                
+        except Exception as e:
+            self.logger.error(f"Failed to count unused activation keys: {str(e)}")
+            return 0
+    
     def get_unused_activation_key(self, product_id: str) -> Optional[str]:
         """Get an unused activation key for a product"""
         try:
-            with self.get_connection() as conn:
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     """SELECT activation_key FROM activation_keys 
@@ -412,10 +812,61 @@ class DatabaseManager:
             self.logger.error(f"Failed to get unused activation key: {str(e)}")
             return None
     
+    def claim_activation_key(self, product_id: str) -> Optional[str]:
+        """Take the oldest unused pre-generated key for a product and mark it used
+        
+        Selecting and marking happen in one write, so two purchases can never
+        be handed the same key. Returns None when no unused key is available.
+        """
+        try:
+            with self.write_conn() as conn:
+                cursor = conn.cursor()
+                if _HAS_RETURNING:
+                    cursor.execute(
+                        """UPDATE activation_keys 
+                           SET used = TRUE, used_date = CURRENT_TIMESTAMP 
+                           WHERE id = (SELECT id FROM activation_keys 
+                                       WHERE product_id = ? AND used = FALSE 
+                                       ORDER BY created_date ASC 
+                                       LIMIT 1) 
+                           RETURNING activation_key""",
+                        (product_id,)
+                    )
+                    rows = cursor.fetchall()
+                    row = rows[0] if rows else None
+                else:
+                    # SQLite < 3.35: same select and update inside one write transaction
+                    cursor.execute('BEGIN IMMEDIATE')
+                    cursor.execute(
+                        """SELECT id, activation_key FROM activation_keys 
+                           WHERE product_id = ? AND used = FALSE 
+                           ORDER BY created_date ASC 
+                           LIMIT 1""",
+                        (product_id,)
+                    )
+                    row = cursor.fetchone()
+                    if row:
+                        cursor.execute(
+                            """UPDATE activation_keys 
+                               SET used = TRUE, used_date = CURRENT_TIMESTAMP 
+                               WHERE id = ?""",
+                            (row['id'],)
+                        )
+                conn.commit()
+                
+                if row:
+                    self.logger.info(f"Pre-generated activation key claimed for product: {product_id}")
+                    return row['activation_key']
+                return None
+                
+        except Exception as e:
+            self.logger.error(f"Failed to claim activation key: {str(e)}")
+            return None
+    
     def mark_activation_key_used(self, activation_key: str, purchase_id: int) -> bool:
         """Mark an activation key as used"""
         try:
-            with self.get_connection() as conn:
+            with self.write_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     """UPDATE activation_keys 
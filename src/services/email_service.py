@@ -5,33 +5,61 @@ Handles all email operations including templates and delivery
 """
 
 import smtplib
+import socket
+import ssl
 import logging
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-from typing import Dict, List, Optional, Any
+import threading
+from email.message import EmailMessage
+from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime
 import os
 import time
 
 
+# Errors after which the shared SMTP session cannot be used again; other
+# SMTPExceptions (e.g. a refused recipient) leave the session intact
+_DEAD_SESSION_ERRORS = (smtplib.SMTPServerDisconnected, socket.timeout, ConnectionError)
+
+
 class EmailService:
     """Enhanced email service with templates and retry logic"""
     
+    # Socket timeout for every SMTP operation, so a half-open connection fails
+    # instead of holding the session lock until the kernel gives up
+    SMTP_TIMEOUT_SECONDS = 30.0
+    # Many servers cap messages per connection, so a session is recycled after this many
+    SMTP_SESSION_MAX_MESSAGES = 100
+    # A session idle for longer than this is checked with NOOP before it is reused
+    SMTP_IDLE_CHECK_SECONDS = 30.0
+    # Health checks report the outcome of a send this recent instead of probing
+    SMTP_HEALTH_FRESH_SECONDS = 60.0
+    # Otherwise they probe on their own connection with this timeout, never the session
+    SMTP_PROBE_TIMEOUT_SECONDS = 5.0
+    
     def __init__(self, config):
         self.config = config
         self.logger = logging.getLogger(__name__)
         self.email_config = config.get_email_config()
+        # One authenticated SMTP session is shared by all sends (see _send_message)
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._smtp_lock = threading.Lock()
+        self._smtp_sent = 0
+        self._smtp_last_used = 0.0
+        # (monotonic time, succeeded) of the last send over the shared session
+        self._last_send: Optional[Tuple[float, bool]] = None
+        # Built once: loading the CA bundle is the expensive part of a TLS context
+        self._ssl_context = ssl.create_default_context()
         
     def _get_smtp_connection(self):
         """Get SMTP connection with proper configuration"""
         try:
             if self.email_config['use_tls']:
-                server = smtplib.SMTP(self.email_config['smtp_server'], self.email_config['smtp_port'])
-                server.starttls()
+                server = smtplib.SMTP(self.email_config['smtp_server'], self.email_config['smtp_port'],
+                                      timeout=self.SMTP_TIMEOUT_SECONDS)
+                server.starttls(context=self._ssl_context)
             else:
-                server = smtplib.SMTP_SSL(self.email_config['smtp_server'], self.email_config['smtp_port'])
+                server = smtplib.SMTP_SSL(self.email_config['smtp_server'], self.email_config['smtp_port'],
+                                          timeout=self.SMTP_TIMEOUT_SECONDS, context=self._ssl_context)
             
             server.login(self.email_config['username'], self.email_config['password'])
             return server
@@ -40,47 +68,99 @@ class EmailService:
             raise
     
     def _create_message(self, to_email: str, subject: str, body: str, 
-                       is_html: bool = False, attachments: Optional[List[Dict]] = None) -> MIMEMultipart:
+                       is_html: bool = False, attachments: Optional[List[Dict]] = None) -> EmailMessage:
         """Create email message with optional attachments"""
-        msg = MIMEMultipart()
+        msg = EmailMessage()
         msg['From'] = self.email_config['from_email']
         msg['To'] = to_email
         msg['Subject'] = subject
         
         # Add body
-        if is_html:
-            msg.attach(MIMEText(body, 'html'))
-        else:
-            msg.attach(MIMEText(body, 'plain'))
+        msg.set_content(body, subtype='html' if is_html else 'plain')
         
         # Add attachments if provided
         if attachments:
             for attachment in attachments:
                 try:
                     with open(attachment['path'], 'rb') as file:
-                        part = MIMEBase('application', 'octet-stream')
-                        part.set_payload(file.read())
-                        encoders.encode_base64(part)
-                        part.add_header(
-                            'Content-Disposition',
-                            f'attachment; filename= {attachment["filename"]}'
+                        msg.add_attachment(
+                            file.read(),
+                            maintype='application',
+                            subtype='octet-stream',
+                            filename=attachment['filename']
                         )
-                        msg.attach(part)
                 except Exception as e:
                     self.logger.error(f"Failed to attach file {attachment['path']}: {str(e)}")
         
         return msg
     
+    def _close_session(self):
+        """Close the shared SMTP session, ignoring errors from a dead connection"""
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+    
+    def _drop_session(self):
+        """Discard a dead SMTP session without waiting on a QUIT reply"""
+        if self._smtp is not None:
+            self._smtp.close()
+            self._smtp = None
+    
+    def _ensure_session(self) -> smtplib.SMTP:
+        """Return a live shared SMTP session; the caller must hold _smtp_lock"""
+        if self._smtp is not None:
+            if self._smtp_sent >= self.SMTP_SESSION_MAX_MESSAGES:
+                self._close_session()
+            elif time.monotonic() - self._smtp_last_used > self.SMTP_IDLE_CHECK_SECONDS:
+                # Back-to-back sends skip this round trip; a session that went
+                # quiet may have been dropped by the server
+                try:
+                    self._smtp.noop()
+                except (smtplib.SMTPException, OSError):
+                    self._drop_session()
+        if self._smtp is None:
+            self._smtp = self._get_smtp_connection()
+            self._smtp_sent = 0
+        self._smtp_last_used = time.monotonic()
+        return self._smtp
+    
+    def _send_message(self, msg: EmailMessage):
+        """Send a message over the shared SMTP session, reconnecting when it has dropped"""
+        with self._smtp_lock:
+            try:
+                try:
+                    self._ensure_session().send_message(msg)
+                except _DEAD_SESSION_ERRORS:
+                    # The server closed the session or stopped answering; retry once on a new one
+                    self._drop_session()
+                    try:
+                        self._ensure_session().send_message(msg)
+                    except _DEAD_SESSION_ERRORS:
+                        self._drop_session()
+                        raise
+            except Exception:
+                self._last_send = (time.monotonic(), False)
+                raise
+            self._smtp_sent += 1
+            self._last_send = (time.monotonic(), True)
+    
+    def close(self):
+        """Quit the shared SMTP session"""
+        with self._smtp_lock:
+            self._close_session()
+    
     def send_email(self, to_email: str, subject: str, body: str, 
                   is_html: bool = False, attachments: Optional[List[Dict]] = None, 
                   retry_count: int = 3) -> bool:
         """Send email with retry logic"""
+        msg = self._create_message(to_email, subject, body, is_html, attachments)
+        
         for attempt in range(retry_count):
             try:
-                msg = self._create_message(to_email, subject, body, is_html, attachments)
-                
-                with self._get_smtp_connection() as server:
-                    server.send_message(msg)
+                self._send_message(msg)
                 
                 self.logger.info(f"Email sent successfully to {to_email}: {subject}")
                 return True
@@ -167,18 +247,6 @@ class EmailService:
         admin_email = self.email_config.get('admin_email', self.email_config['from_email'])
         return self.send_email(admin_email, subject, body, is_html=True)
     
-    def check_connection(self) -> bool:
-        """Check if email service connection is working"""
-        try:
-            with self._get_smtp_connection() as server:
-                # Test connection by getting server status
-                server.noop()  # No-operation command to test connection
-                self.logger.info("Email service connection test successful")
-                return True
-        except Exception as e:
-            self.logger.error(f"Email service connection test failed: {str(e)}")
-            return False
-    
     def test_email_connection(self) -> bool:
         """Test email connection and configuration"""
         try:
@@ -240,13 +308,28 @@ class EmailService:
         """
     
     def check_connection(self) -> bool:
-        """Check if email service connection is working"""
+        """Check if email service connection is working
+        
+        A recent send already shows whether mail goes out, so its outcome is
+        reported as is. Otherwise the server is probed with NOOP on a separate
+        short-timeout connection without logging in; the shared session and
+        its lock are left to the sends, so a stuck server never delays them.
+        """
+        last_send = self._last_send
+        if last_send is not None and time.monotonic() - last_send[0] < self.SMTP_HEALTH_FRESH_SECONDS:
+            return last_send[1]
+        
         try:
-            with self._get_smtp_connection() as server:
-                # Perform a simple NOOP command to test connection
+            host, port = self.email_config['smtp_server'], self.email_config['smtp_port']
+            if self.email_config['use_tls']:
+                server = smtplib.SMTP(host, port, timeout=self.SMTP_PROBE_TIMEOUT_SECONDS)
+            else:
+                server = smtplib.SMTP_SSL(host, port, timeout=self.SMTP_PROBE_TIMEOUT_SECONDS,
+                                          context=self._ssl_context)
+            with server:
                 server.noop()
-                self.logger.info("Email service connection test successful")
-                return True
+            self.logger.info("Email service connection test successful")
+            return True
         except Exception as e:
             self.logger.error(f"Email service connection test failed: {str(e)}")
             return False
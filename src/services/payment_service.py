@@ -5,25 +5,75 @@ Handles PayPal integration and payment processing
 """
 
 import logging
-import paypalrestsdk
-from typing import Dict, Optional, Any
+import threading
+from typing import Dict, Iterable, Optional, Any
 from datetime import datetime
 import uuid
 import json
 
+from ..validators.utils import generate_activation_key, generate_activation_key_suffix
+
+
+class _SessionRequests:
+    """Stand-in for the `requests` module inside the PayPal SDK
+    
+    The SDK calls `requests.request(...)` for every API call, which opens a new
+    TCP connection and TLS handshake each time. Routing those calls through one
+    Session keeps connections to PayPal alive between payments; every other
+    attribute falls through to the real module.
+    """
+    
+    def __init__(self, requests_module, session):
+        self._requests = requests_module
+        self._session = session
+    
+    def request(self, method, url, **kwargs):
+        return self._session.request(method, url, **kwargs)
+    
+    def __getattr__(self, name):
+        return getattr(self._requests, name)
+
 
 class PaymentService:
     """Enhanced payment service with PayPal integration"""
     
+    # Unused pre-generated activation key suffixes kept on hand per product;
+    # small enough that a top-up is a single short write transaction
+    ACTIVATION_KEY_POOL_SIZE = 50
+    
     def __init__(self, config, database_manager):
         self.config = config
         self.db = database_manager
         self.logger = logging.getLogger(__name__)
-        self._initialize_paypal()
+        # The PayPal SDK (and the requests/cryptography stack behind it) is
+        # imported on first use rather than when the server boots
+        self._sdk = None
+        self._refill_lock = threading.Lock()
+    
+    def initialize(self, product_ids: Iterable[str] = ()):
+        """Fill the activation key pool for each product in the background"""
+        self._start_refill(list(product_ids))
+    
+    @property
+    def _paypal(self):
+        """The configured paypalrestsdk module, imported on first access"""
+        if self._sdk is None:
+            self._sdk = self._initialize_paypal()
+        return self._sdk
         
     def _initialize_paypal(self):
         """Initialize PayPal SDK with configuration"""
         try:
+            import paypalrestsdk
+            import paypalrestsdk.api
+            import requests
+            from requests.adapters import HTTPAdapter
+            
+            # Keep-alive connection pool shared by every PayPal API call
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=20))
+            paypalrestsdk.api.requests = _SessionRequests(requests, session)
+            
             paypal_config = self.config.get_paypal_config()
             
             paypalrestsdk.configure({
@@ -33,6 +83,7 @@ class PaymentService:
             })
             
             self.logger.info(f"PayPal SDK initialized in {paypal_config['mode']} mode")
+            return paypalrestsdk
             
         except Exception as e:
             self.logger.error(f"Failed to initialize PayPal SDK: {str(e)}")
@@ -43,7 +94,7 @@ class PaymentService:
         """Create a PayPal payment"""
         try:
             # Create payment object
-            payment = paypalrestsdk.Payment({
+            payment = self._paypal.Payment({
                 "intent": "sale",
                 "payer": {
                     "payment_method": "paypal"
@@ -113,77 +164,88 @@ class PaymentService:
             self.logger.error(f"Payment creation failed: {str(e)}")
             return None
     
-    def execute_payment(self, payment_id: str, payer_id: str) -> Optional[Dict[str, Any]]:
-        """Execute a PayPal payment after user approval"""
+    def execute_payment(self, payment_id: str, payer_id: str) -> Dict[str, Any]:
+        """Execute a PayPal payment after user approval
+        
+        Everything that can reject the payment is checked before PayPal is asked
+        to charge it. Once the charge may have gone through, any failure leaves
+        the purchase 'pending_review' rather than 'failed', so a paid order is
+        never written off.
+        """
         try:
             # Get the payment
-            payment = paypalrestsdk.Payment.find(payment_id)
+            payment = self._paypal.Payment.find(payment_id)
             
             if not payment:
                 self.logger.error(f"Payment not found: {payment_id}")
-                return None
+                return {'success': False, 'error': 'Payment not found'}
             
-            # Execute the payment
-            if payment.execute({"payer_id": payer_id}):
-                # Get purchase from database
-                purchase = self.db.get_purchase_by_paypal_id(payment_id)
-                
-                if not purchase:
-                    self.logger.error(f"Purchase not found for payment: {payment_id}")
-                    return None
-                
-                # Generate activation key
-                activation_key = self._generate_activation_key(purchase['product_id'])
-                
-                # Update purchase status
-                success = self.db.update_purchase_status(
-                    paypal_payment_id=payment_id,
-                    status='completed',
-                    activation_key=activation_key
-                )
-                
-                if success:
-                    self.logger.info(f"Payment executed successfully: {payment_id}")
-                    
-                    return {
-                        'payment_id': payment_id,
-                        'status': 'completed',
-                        'activation_key': activation_key,
-                        'purchase': purchase,
-                        'transaction_id': payment.transactions[0].related_resources[0].sale.id
-                    }
-                else:
-                    self.logger.error(f"Failed to update purchase status for payment: {payment_id}")
-                    return None
-            else:
-                self.logger.error(f"PayPal payment execution failed: {payment.error}")
-                
-                # Update purchase status to failed
-                self.db.update_purchase_status(
-                    paypal_payment_id=payment_id,
-                    status='failed'
-                )
-                
-                return None
+            # The product was recorded as the item SKU in create_payment and must
+            # match the purchase created alongside the payment
+            product_id = payment.transactions[0].item_list.items[0].sku
+            purchase = self.db.get_purchase_by_paypal_id(payment_id)
+            
+            if not purchase or purchase['product_id'] != product_id:
+                self.logger.error(f"Payment {payment_id} does not match a pending purchase")
+                self.db.update_open_purchase_status(payment_id, 'failed')
+                return {'success': False, 'error': 'Purchase not found'}
+            
+            if purchase['status'] == 'completed':
+                self.logger.warning(f"Payment already completed: {payment_id}")
+                return {'success': False, 'error': 'Payment already completed'}
                 
         except Exception as e:
+            # Nothing has been charged yet
             self.logger.error(f"Payment execution failed: {str(e)}")
+            self.db.update_open_purchase_status(payment_id, 'failed')
+            return {'success': False, 'error': 'Payment execution failed'}
+        
+        try:
+            executed = payment.execute({"payer_id": payer_id})
+        except Exception as e:
+            # The request may have reached PayPal, so the customer may have been charged
+            self.logger.error(f"PayPal payment execution failed for {payment_id}, needs review: {str(e)}")
+            self.db.update_open_purchase_status(payment_id, 'pending_review')
+            return {'success': False, 'error': 'Payment execution failed'}
+        
+        if not executed:
+            self.logger.error(f"PayPal payment execution failed: {payment.error}")
+            self.db.update_open_purchase_status(payment_id, 'failed')
+            return {'success': False, 'error': 'Payment execution failed'}
+        
+        try:
+            transaction_id = payment.transactions[0].related_resources[0].sale.id
+            activation_key = self._generate_activation_key(product_id)
+            
+            # Complete the purchase and read it back in a single write
+            purchase = self.db.complete_purchase(payment_id, product_id, activation_key)
+            
+            if not purchase:
+                raise RuntimeError("purchase could not be completed")
+            
+            self.logger.info(f"Payment executed successfully: {payment_id}")
+            
+            return {
+                'success': True,
+                'payment_id': payment_id,
+                'status': 'completed',
+                'activation_key': activation_key,
+                'email': purchase['email'],
+                'product_id': purchase['product_id'],
+                'purchase': purchase,
+                'transaction_id': transaction_id
+            }
             
-            # Update purchase status to failed
-            try:
-                self.db.update_purchase_status(
-                    paypal_payment_id=payment_id,
-                    status='failed'
-                )
-            except:
-                pass
-            
-            return None
+        except Exception as e:
+            # Charged but not delivered: keep the purchase for manual follow-up
+            self.logger.error(f"Payment {payment_id} was charged but not completed, needs review: {str(e)}")
+            self.db.update_open_purchase_status(payment_id, 'pending_review')
+            return {'success': False, 'error': 'Payment received but the purchase could not be completed. Please contact support.'}
     
     def get_payment_details(self, payment_id: str) -> Optional[Dict[str, Any]]:
         """Get PayPal payment details"""
         try:
-            payment = paypalrestsdk.Payment.find(payment_id)
+            payment = self._paypal.Payment.find(payment_id)
             
             if payment:
                 return {
@@ -228,7 +290,7 @@ class PaymentService:
         """Process a refund for a payment"""
         try:
             # Get the payment
-            payment = paypalrestsdk.Payment.find(payment_id)
+            payment = self._paypal.Payment.find(payment_id)
             
             if not payment or payment.state != 'approved':
                 self.logger.error(f"Payment not found or not approved: {payment_id}")
@@ -399,20 +461,50 @@ class PaymentService:
             self.logger.error(f"Failed to handle sale refunded webhook: {str(e)}")
             return False
     
+    def refill_activation_keys(self, product_id: str) -> int:
+        """Top up a product's unused activation keys to ACTIVATION_KEY_POOL_SIZE
+        
+        The pool holds only the random part of each key; the date is added
+        when a purchase claims it. Every worker calls this at startup, but the
+        count and insert share one transaction, so only the first worker adds
+        keys. Returns the number of keys added.
+        """
+        if self.db.count_unused_activation_keys(product_id) >= self.ACTIVATION_KEY_POOL_SIZE:
+            return 0
+        suffixes = [generate_activation_key_suffix() for _ in range(self.ACTIVATION_KEY_POOL_SIZE)]
+        return self.db.top_up_activation_keys(product_id, suffixes)
+    
+    def _refill(self, product_ids):
+        """Refill the key pool for each product; runs on the refill thread"""
+        try:
+            for product_id in product_ids:
+                added = self.refill_activation_keys(product_id)
+                if added:
+                    self.logger.info(f"Added {added} pre-generated activation keys for product: {product_id}")
+        except Exception as e:
+            self.logger.error(f"Activation key refill failed: {str(e)}")
+        finally:
+            self._refill_lock.release()
+    
+    def _start_refill(self, product_ids):
+        """Refill the key pool on a background thread unless a refill is already running"""
+        if product_ids and self._refill_lock.acquire(blocking=False):
+            threading.Thread(target=self._refill, args=(product_ids,),
+                             name='activation-key-refill', daemon=True).start()
+    
     def _generate_activation_key(self, product_id: str) -> str:
         """Generate a unique activation key"""
         try:
-            # Try to get a pre-generated activation key first
-            activation_key = self.db.get_unused_activation_key(product_id)
-            
-            if activation_key:
-                return activation_key
+            # Try to take a pre-generated suffix first; the key is dated at claim
+            # time either way (full keys pooled by older releases keep their suffix)
+            pooled = self.db.claim_activation_key(product_id)
             
-            # Generate a new activation key if none available
-            timestamp = datetime.now().strftime('%Y%m%d')
-            unique_id = str(uuid.uuid4()).replace('-', '').upper()[:12]
+            if pooled:
+                return generate_activation_key(product_id, unique_part=pooled.rpartition('-')[2])
             
-            activation_key = f"{product_id.upper()}-{timestamp}-{unique_id}"
+            # The pool ran dry: refill it in the background and generate this key inline
+            self._start_refill([product_id])
+            activation_key = generate_activation_key(product_id)
             
             self.logger.info(f"Generated activation key for product: {product_id}")
             return activation_key
@@ -442,7 +534,7 @@ class PaymentService:
         try:
             # Try to get PayPal API credentials info
             # This is a simple test to verify the connection
-            test_payment = paypalrestsdk.Payment({
+            test_payment = self._paypal.Payment({
                 "intent": "sale",
                 "payer": {"payment_method": "paypal"},
                 "transactions": [{
@@ -460,5 +552,12 @@ class PaymentService:
             return False
     
     def check_connection(self) -> bool:
-        """Check if PayPal service connection is working"""
-        return self.test_paypal_connection()
+        """Check that PayPal is configured, without importing the SDK
+        
+        The health check calls this every few seconds from boot, so going
+        through the SDK here would import it in every worker and undo the lazy
+        import. test_paypal_connection() still exercises the SDK on demand.
+        """
+        paypal_config = self.config.get_paypal_config()
+        return bool(paypal_config['client_id'] and paypal_config['client_secret']
+                    and paypal_config['mode'] in ('sandbox', 'live'))
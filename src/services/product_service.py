@@ -5,25 +5,83 @@ Handles product management, downloads, and file operations
 """
 
 import os
+import copy
+import shutil
 import logging
 import hashlib
 import zipfile
-import tempfile
-from typing import Dict, List, Optional, Any
+import threading
+import time
+from typing import Dict, FrozenSet, Iterator, List, Optional, Any, Tuple
 from datetime import datetime, timedelta
 import mimetypes
 from pathlib import Path
 
 
+# Formats that are already compressed; deflating them again only burns CPU
+_STORED_EXTENSIONS = frozenset(('.zip', '.gz', '.bz2', '.xz', '.7z', '.rar', '.jpg', '.jpeg', '.png', '.mp4'))
+
+# Earliest timestamp a ZIP entry can carry
+_ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+# Product files are copied into archive entries in reads of this size, never whole
+ZIP_CHUNK_SIZE = 64 * 1024
+
+
+class _ZipStreamBuffer:
+    """Write-only sink that lets ZipFile emit an archive piece by piece"""
+    
+    def __init__(self, offset: int = 0):
+        self._chunks = []
+        # Bytes already sent ahead of this sink, so entry offsets stay absolute
+        self._position = offset
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self._position
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        """Return and clear everything written since the last drain"""
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
 class ProductService:
     """Enhanced product service with file management and security"""
     
+    # Deflate level for cached product entries; past 6, zlib spends far more
+    # CPU for a few bytes on typical text
+    ZIP_COMPRESS_LEVEL = 6
+    
     def __init__(self, config, database_manager):
         self.config = config
         self.db = database_manager
         self.logger = logging.getLogger(__name__)
         self.products = self._load_products()
+        self._available_products: Optional[Dict[str, Dict[str, Any]]] = None
+        self._available_product_ids: Optional[FrozenSet[str]] = None
         self.download_dir = self._get_download_directory()
+        # product_id -> (file signature, compressed entry bytes, entry ZipInfos, entries SHA-256)
+        self._zip_cache: Dict[str, Tuple[tuple, bytes, List[zipfile.ZipInfo], bytes]] = {}
+        self._zip_cache_lock = threading.Lock()
+    
+    def initialize(self):
+        """Build the product ID set ahead of the first request
+        
+        Download archives are left to the first download of each product:
+        warming them here would compress every product in every worker while
+        it boots, blocking its event loop.
+        """
+        self.get_available_product_ids()
         
     def _load_products(self) -> Dict[str, Dict[str, Any]]:
         """Load product definitions from configuration"""
@@ -136,6 +194,47 @@ class ProductService:
             self.logger.error(f"Failed to get products: {str(e)}")
             return []
     
+    def get_available_products(self) -> Dict[str, Dict[str, Any]]:
+        """Get active products keyed by product ID (computed once and cached)"""
+        if self._available_products is None:
+            self._available_products = {
+                product_id: product
+                for product_id, product in self.products.items()
+                if product.get('active', True)
+            }
+        return self._available_products
+    
+    def get_available_product_ids(self) -> FrozenSet[str]:
+        """Get the IDs of active products as a frozenset for O(1) membership checks"""
+        if self._available_product_ids is None:
+            self._available_product_ids = frozenset(self.get_available_products())
+        return self._available_product_ids
+    
+    def invalidate_cache(self):
+        """Drop the cached product catalog so the next lookup rebuilds it"""
+        self._available_products = None
+        self._available_product_ids = None
+    
+    def reload(self):
+        """Reload product definitions and swap in the new catalog
+        
+        Everything is built before any attribute is replaced, so concurrent
+        requests keep using the old catalog until the new one is complete.
+        """
+        products = self._load_products()
+        available = {
+            product_id: product
+            for product_id, product in products.items()
+            if product.get('active', True)
+        }
+        
+        self.products = products
+        self._available_products = available
+        self._available_product_ids = frozenset(available)
+        with self._zip_cache_lock:
+            self._zip_cache.clear()
+        self.logger.info(f"Product catalog reloaded ({len(available)} active products)")
+    
     def get_product_by_id(self, product_id: str) -> Optional[Dict[str, Any]]:
         """Get a specific product by ID"""
         try:
@@ -408,8 +507,109 @@ class ProductService:
             self.logger.error(f"Failed to create product package: {str(e)}")
             return None
     
-    def _generate_readme_content(self, product: Dict[str, Any]) -> str:
-        """Generate README content for product package"""
+    def iter_product_files(self, product_id: str) -> Iterator[Tuple[str, str]]:
+        """Yield (path, arcname) pairs for the files shipped with a product"""
+        product = self.get_product_by_id(product_id)
+        
+        if not product:
+            self.logger.error(f"Product not found: {product_id}")
+            return
+        
+        file_path = os.path.join(self.download_dir, product['file_path'])
+        
+        if os.path.exists(file_path):
+            yield file_path, product['file_path']
+        else:
+            self.logger.error(f"Product file not found: {file_path}")
+    
+    def _get_zip_entries(self, product_id: str,
+                         product_files: List[Tuple[str, str]]) -> Tuple[bytes, List[zipfile.ZipInfo], bytes]:
+        """Return the cached compressed entries for a product, rebuilding if its files changed"""
+        # One stat per file: enough to notice a replaced product file without re-reading it
+        stats = [(path, os.stat(path)) for path, _ in product_files]
+        signature = tuple((path, st.st_mtime_ns, st.st_size) for path, st in stats)
+        
+        with self._zip_cache_lock:
+            cached = self._zip_cache.get(product_id)
+            if cached is None or cached[0] != signature:
+                product = self.get_product_by_id(product_id)
+                buffer = _ZipStreamBuffer()
+                # Nothing in the entries depends on the wall clock: every timestamp is the
+                # newest product file's mtime in UTC, so every worker, before and after a
+                # restart, builds the same bytes and resumed downloads keep a valid ETag
+                date_time = max(time.gmtime(max(st.st_mtime for _, st in stats))[:6], _ZIP_EPOCH)
+                
+                # Built once per product per worker; formats that are already compressed are stored
+                with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                    for (file_path, arcname), (_, st) in zip(product_files, stats):
+                        zinfo = zipfile.ZipInfo(arcname, date_time=date_time)
+                        zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+                        if os.path.splitext(arcname)[1].lower() in _STORED_EXTENSIONS:
+                            zinfo.compress_type = zipfile.ZIP_STORED
+                        else:
+                            zinfo.compress_type = zipfile.ZIP_DEFLATED
+                        zinfo._compresslevel = self.ZIP_COMPRESS_LEVEL
+                        with open(file_path, 'rb') as src, zipf.open(zinfo, 'w', force_zip64=True) as dst:
+                            shutil.copyfileobj(src, dst, ZIP_CHUNK_SIZE)
+                    readme_info = zipfile.ZipInfo('README.txt', date_time=date_time)
+                    readme_info.external_attr = 0o644 << 16
+                    zipf.writestr(readme_info, self._generate_readme_content(product, datetime(*date_time)),
+                                  compress_type=zipfile.ZIP_DEFLATED, compresslevel=self.ZIP_COMPRESS_LEVEL)
+                    entries = buffer.drain()
+                    infos = list(zipf.filelist)
+                    # Only the entries are cached; each download writes its own
+                    # central directory, so nothing more is needed from this archive
+                    zipf.filelist.clear()
+                
+                cached = (signature, entries, infos, hashlib.sha256(entries).digest())
+                self._zip_cache[product_id] = cached
+                self.logger.info(f"Cached download archive for {product_id} ({len(entries)} bytes)")
+        
+        return cached[1], cached[2], cached[3]
+    
+    def build_product_zip(self, product_id: str, activation_key: str,
+                          product_files: List[Tuple[str, str]]) -> Tuple[List[bytes], str]:
+        """Assemble a download bundle as ZIP byte chunks plus a strong ETag
+        
+        The product files and README are compressed once per product and
+        cached; each download only compresses its LICENSE.txt and writes a
+        new central directory covering the cached entries plus the license.
+        The license entry reuses the cached entries' timestamp, so the same
+        key always produces the same bytes and the ETag and byte ranges stay
+        valid across requests (resumable downloads).
+        """
+        product = self.get_product_by_id(product_id)
+        entries, infos, entries_digest = self._get_zip_entries(product_id, product_files)
+        
+        buffer = _ZipStreamBuffer(offset=len(entries))
+        
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for zinfo in infos:
+                zinfo = copy.copy(zinfo)
+                zipf.filelist.append(zinfo)
+                zipf.NameToInfo[zinfo.filename] = zinfo
+            license_info = zipfile.ZipInfo('LICENSE.txt', date_time=infos[-1].date_time)
+            license_info.compress_type = zipfile.ZIP_DEFLATED
+            # Compressed on every download; level 1 is nearly as small for a short text file
+            zipf.writestr(license_info, self._generate_license_content(product, activation_key),
+                          compresslevel=1)
+        
+        # License entry plus the central directory written when the archive is closed
+        tail = buffer.drain()
+        etag = hashlib.sha256(entries_digest + tail).hexdigest()[:32]
+        return [entries, tail], etag
+    
+    def _generate_license_content(self, product: Dict[str, Any], activation_key: str) -> str:
+        """Generate the per-purchase license file for a download bundle"""
+        return (
+            f"{product['name']} - Version {product['version']}\n"
+            f"Activation Key: {activation_key}\n\n"
+            "Use this activation key when prompted during installation.\n"
+        )
+    
+    def _generate_readme_content(self, product: Dict[str, Any],
+                                 generated: Optional[datetime] = None) -> str:
+        """Generate README content for product package, dated `generated` (default: now)"""
         try:
             readme = f"""
 {product['name']} - Version {product['version']}
@@ -437,7 +637,7 @@ If you need assistance, please contact our support team.
 
 Thank you for choosing Gotcha Guardian!
 
-Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+Generated on: {(generated or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')}
 """
             return readme
             
@@ -4,9 +4,13 @@ Validation Utilities for Gotcha Guardian Payment Server
 Provides utility functions for input validation and sanitization
 """
 
+import os
 import re
 import html
+import base64
 import bleach
+import threading
+from collections import deque
 from typing import Optional, Union, List, Dict, Any
 from decimal import Decimal, InvalidOperation
 from datetime import datetime
@@ -15,19 +19,20 @@ import secrets
 import string
 
 
+# Basic email regex pattern, compiled once for every intake check
+_EMAIL_RE = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+
+
 def validate_email(email: str) -> bool:
     """Validate email address format"""
     if not email or not isinstance(email, str):
         return False
     
-    # Basic email regex pattern
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    
-    if not re.match(pattern, email):
+    # Length first, so oversized input never reaches the regex
+    if len(email) > 255:
         return False
     
-    # Additional checks
-    if len(email) > 255:
+    if not _EMAIL_RE.fullmatch(email):
         return False
     
     # Check for consecutive dots
@@ -42,11 +47,21 @@ def validate_email(email: str) -> bool:
     return True
 
 
+# Activation keys are checked on every download, so the patterns are compiled once
+_ACTIVATION_KEY_MAX_LENGTH = 100
+_KEY_PRODUCT_RE = re.compile(r'[A-Z0-9_]+')
+_KEY_UNIQUE_RE = re.compile(r'[A-Z0-9\-]+')
+
+
 def validate_activation_key(key: str) -> Dict[str, Any]:
     """Validate activation key format and extract information"""
     if not key or not isinstance(key, str):
         return {'valid': False, 'error': 'Invalid key format'}
     
+    # Reject oversized input before splitting or matching it
+    if len(key) > _ACTIVATION_KEY_MAX_LENGTH:
+        return {'valid': False, 'error': 'Invalid key length'}
+    
     # Expected format: PRODUCT-YYYYMMDD-XXXXXXXXXXXX
     parts = key.split('-')
     
@@ -58,7 +73,7 @@ def validate_activation_key(key: str) -> Dict[str, Any]:
     unique_part = '-'.join(parts[2:]) if len(parts) > 2 else ''
     
     # Validate product part
-    if not re.match(r'^[A-Z0-9_]+$', product_part):
+    if not _KEY_PRODUCT_RE.fullmatch(product_part):
         return {'valid': False, 'error': 'Invalid product identifier'}
     
     # Validate date part
@@ -71,7 +86,7 @@ def validate_activation_key(key: str) -> Dict[str, Any]:
         creation_date = None
     
     # Validate unique part
-    if not re.match(r'^[A-Z0-9\-]+$', unique_part):
+    if not _KEY_UNIQUE_RE.fullmatch(unique_part):
         return {'valid': False, 'error': 'Invalid unique identifier'}
     
     return {
@@ -243,14 +258,35 @@ def generate_secure_token(length: int = 32) -> str:
     return ''.join(secrets.choice(alphabet) for _ in range(length))
 
 
-def generate_activation_key(product_id: str, date: Optional[datetime] = None) -> str:
-    """Generate a new activation key"""
+# Random activation key suffixes are drawn from the OS CSPRNG in batches, so a
+# burst of payments costs one urandom call per batch instead of one per key
+_KEY_SUFFIX_BATCH = 64
+_key_suffixes = deque()
+_key_suffix_lock = threading.Lock()
+
+
+def generate_activation_key_suffix() -> str:
+    """Return a 12-character random key suffix (60 bits, uppercase base32)"""
+    with _key_suffix_lock:
+        if not _key_suffixes:
+            random_bytes = os.urandom(8 * _KEY_SUFFIX_BATCH)
+            _key_suffixes.extend(
+                base64.b32encode(random_bytes[i:i + 8]).decode('ascii')[:12]
+                for i in range(0, len(random_bytes), 8)
+            )
+        return _key_suffixes.popleft()
+
+
+def generate_activation_key(product_id: str, date: Optional[datetime] = None,
+                            unique_part: Optional[str] = None) -> str:
+    """Generate a new activation key, optionally around a pre-generated suffix"""
     if not date:
         date = datetime.now()
     
     # Format: PRODUCT-YYYYMMDD-XXXXXXXXXXXX
     date_str = date.strftime('%Y%m%d')
-    unique_part = generate_secure_token(12).upper()
+    if not unique_part:
+        unique_part = generate_activation_key_suffix()
     
     return f"{product_id.upper()}-{date_str}-{unique_part}"
 
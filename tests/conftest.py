@@ -22,23 +22,20 @@ from src.services.product_service import ProductService
 @pytest.fixture(scope="session")
 def test_config():
     """Create a test configuration."""
-    config = Config()
-    
-    # Override with test settings
-    config.DEBUG = True
-    config.TESTING = True
-    config.DATABASE_URL = "sqlite:///:memory:"
-    config.SECRET_KEY = "test-secret-key-for-testing-only"
-    config.PAYPAL_CLIENT_ID = "test-paypal-client-id"
-    config.PAYPAL_CLIENT_SECRET = "test-paypal-client-secret"
-    config.PAYPAL_SANDBOX = True
-    config.SMTP_SERVER = "localhost"
-    config.SMTP_PORT = 587
-    config.SMTP_USERNAME = "test@example.com"
-    config.SMTP_PASSWORD = "test-password"
-    config.FROM_EMAIL = "test@example.com"
-    config.ADMIN_EMAIL = "admin@example.com"
-    
+    # Config is frozen, so test settings are passed in at construction
+    config = Config(
+        DEBUG=True,
+        DATABASE_URL="sqlite:///:memory:",
+        SECRET_KEY="test-secret-key-for-testing-only",
+        PAYPAL_CLIENT_ID="test-paypal-client-id",
+        PAYPAL_CLIENT_SECRET="test-paypal-client-secret",
+        PAYPAL_MODE="sandbox",
+        SMTP_SERVER="localhost",
+        SMTP_PORT=587,
+        EMAIL_ADDRESS="test@example.com",
+        EMAIL_PASSWORD="test-password"
+    )
+
     return config
 
 
@@ -50,6 +47,25 @@ def temp_dir():
     shutil.rmtree(temp_path, ignore_errors=True)
 
 
+@pytest.fixture(scope="function")
+def database(temp_dir):
+    """Create a real, pooled database manager backed by a temporary SQLite file."""
+    config = Config(DATABASE_URL=f"sqlite:///{os.path.join(temp_dir, 'test.db')}")
+    db = DatabaseManager(config)
+    assert db.initialize_database()
+    db.configure_pool(size=2)
+    yield db
+    db._pool.close()
+
+
+@pytest.fixture(scope="function")
+def payment_server_module(temp_dir, monkeypatch):
+    """Import the real payment server, keeping the files its first import creates in a temp dir."""
+    monkeypatch.chdir(temp_dir)
+    import payment_server
+    return payment_server
+
+
 @pytest.fixture(scope="function")
 def mock_database(test_config):
     """Create a mock database manager."""
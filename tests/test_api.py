@@ -3,6 +3,7 @@
 
 import pytest
 import json
+import threading
 from unittest.mock import patch, Mock
 
 
@@ -175,9 +176,218 @@ class TestPaymentEndpoints:
             assert 'not found' in data['error'].lower()
 
 
+class TestDownloadEndpoint:
+    """Test which download requests use up one of the key's downloads."""
+    
+    ACTIVATION_KEY = 'BASIC-20240101-AAAAAAAAAAAA'
+    ARCHIVE = bytes(range(256)) * 4
+    
+    @pytest.fixture
+    def download_client(self, payment_server_module, database):
+        """Serve downloads from a real database and a fixed archive."""
+        database.create_purchase('buyer@example.com', 'basic', 9.99, 'PAY-DL')
+        database.complete_purchase('PAY-DL', 'basic', self.ACTIVATION_KEY)
+        
+        product_service = Mock()
+        product_service.iter_product_files.return_value = [('/downloads/gotcha.exe', 'gotcha.exe')]
+        product_service.build_product_zip.return_value = (
+            [self.ARCHIVE[:512], self.ARCHIVE[512:]], 'archive-etag'
+        )
+        
+        with patch.object(payment_server_module, 'db_manager', database), \
+             patch.object(payment_server_module, 'product_service', product_service), \
+             patch.object(payment_server_module.limiter, 'enabled', False):
+            yield payment_server_module.app.test_client()
+    
+    def _download_count(self, database):
+        return database.get_purchase_by_activation_key(self.ACTIVATION_KEY)['download_count']
+    
+    @pytest.mark.integration
+    @pytest.mark.api
+    def test_resume_and_revalidation_do_not_count(self, download_client, database):
+        """Test Range and If-None-Match requests reuse the download already counted."""
+        url = f'/api/download/{self.ACTIVATION_KEY}'
+        
+        response = download_client.get(url)
+        assert response.status_code == 200
+        assert response.data == self.ARCHIVE
+        assert self._download_count(database) == 1
+        
+        response = download_client.get(url, headers={'Range': 'bytes=100-'})
+        assert response.status_code == 206
+        assert response.data == self.ARCHIVE[100:]
+        
+        response = download_client.get(url, headers={'If-None-Match': '"archive-etag"'})
+        assert response.status_code == 304
+        
+        assert self._download_count(database) == 1
+    
+    @pytest.mark.integration
+    @pytest.mark.api
+    def test_full_download_is_one_claim(self, download_client, database):
+        """Test a new download builds the archive from the claimed row without another lookup."""
+        url = f'/api/download/{self.ACTIVATION_KEY}'
+        
+        with patch.object(database, 'get_purchase_by_activation_key') as lookup:
+            response = download_client.get(url)
+        
+        assert response.status_code == 200
+        lookup.assert_not_called()
+        assert self._download_count(database) == 1
+    
+    @pytest.mark.integration
+    @pytest.mark.api
+    def test_unknown_key_is_not_found(self, download_client):
+        """Test a well-formed key without a purchase is a 404, not a spent limit."""
+        response = download_client.get('/api/download/BASIC-20240101-UNKNOWNUNKNO')
+        
+        assert response.status_code == 404
+    
+    @pytest.mark.integration
+    @pytest.mark.api
+    def test_range_from_first_byte_counts(self, download_client, database):
+        """Test a ranged request that starts the archive over is a new download."""
+        url = f'/api/download/{self.ACTIVATION_KEY}'
+        
+        download_client.get(url)
+        response = download_client.get(url, headers={'Range': 'bytes=0-99'})
+        
+        assert response.status_code == 206
+        assert self._download_count(database) == 2
+    
+    @pytest.mark.integration
+    @pytest.mark.api
+    def test_range_after_limit_is_refused(self, download_client, database, payment_server_module):
+        """Test a range from past the first byte cannot download an exhausted key's archive."""
+        url = f'/api/download/{self.ACTIVATION_KEY}'
+        max_attempts = payment_server_module.config.MAX_DOWNLOAD_ATTEMPTS
+        for _ in range(max_attempts):
+            download_client.get(url)
+        
+        for headers in ({'Range': 'bytes=1-'}, {'If-None-Match': '"archive-etag"'}):
+            response = download_client.get(url, headers=headers)
+            assert response.status_code == 403
+        
+        assert self._download_count(database) == max_attempts
+    
+    @pytest.mark.integration
+    @pytest.mark.api
+    def test_range_long_after_download_counts(self, download_client, database):
+        """Test a range past the resume window is counted as a new download."""
+        url = f'/api/download/{self.ACTIVATION_KEY}'
+        download_client.get(url)
+        with database.write_conn() as conn:
+            conn.execute(
+                "UPDATE purchases SET last_download = datetime('now', '-1 day') WHERE activation_key = ?",
+                (self.ACTIVATION_KEY,)
+            )
+            conn.commit()
+        
+        response = download_client.get(url, headers={'Range': 'bytes=100-'})
+        
+        assert response.status_code == 206
+        assert self._download_count(database) == 2
+    
+    @pytest.mark.integration
+    @pytest.mark.api
+    def test_full_downloads_stop_at_limit(self, download_client, database, payment_server_module):
+        """Test full downloads beyond MAX_DOWNLOAD_ATTEMPTS are refused."""
+        url = f'/api/download/{self.ACTIVATION_KEY}'
+        max_attempts = payment_server_module.config.MAX_DOWNLOAD_ATTEMPTS
+        
+        statuses = [download_client.get(url).status_code for _ in range(max_attempts + 1)]
+        
+        assert statuses == [200] * max_attempts + [403]
+        assert self._download_count(database) == max_attempts
+
+
+class TestGeventPatching:
+    """Test gevent patches the stdlib only when the module runs as the server."""
+    
+    @pytest.mark.unit
+    @pytest.mark.api
+    def test_import_does_not_patch(self, payment_server_module):
+        """Test importing the app (dev server, tests, gunicorn) leaves the stdlib alone."""
+        import os
+        import runpy
+        import sys
+        
+        gevent = Mock()
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'payment_server.py')
+        with patch.dict(sys.modules, {'gevent': gevent, 'gevent.monkey': gevent.monkey}):
+            namespace = runpy.run_path(path, run_name='payment_server_copy')
+        
+        gevent.monkey.patch_all.assert_not_called()
+        assert namespace['monkey'] is None
+
+
+class TestResponseTimestamps:
+    """Test the timestamp format of JSON responses."""
+    
+    @pytest.mark.unit
+    @pytest.mark.api
+    def test_timestamp_matches_local_isoformat(self, payment_server_module):
+        """Test timestamps keep the local, microsecond datetime.now().isoformat() format."""
+        from datetime import datetime
+        
+        before = datetime.now()
+        stamp = payment_server_module.create_error_response('error')['timestamp']
+        after = datetime.now()
+        
+        parsed = datetime.fromisoformat(stamp)
+        assert parsed.tzinfo is None
+        assert before <= parsed <= after
+        assert stamp == parsed.isoformat()
+    
+    @pytest.mark.unit
+    @pytest.mark.api
+    def test_timestamp_keeps_microseconds(self, payment_server_module):
+        """Test the sub-second part is carried as six-digit microseconds."""
+        with patch.object(payment_server_module.time, 'time_ns', return_value=1_700_000_000_123_456_789):
+            stamp = payment_server_module._iso_now()
+        
+        assert stamp.endswith('.123456')
+
+
+class TestHealthProbes:
+    """Test health probes do not pile up behind a slow service."""
+    
+    @pytest.mark.unit
+    @pytest.mark.api
+    def test_running_probe_is_not_resubmitted(self, payment_server_module):
+        """Test a probe still running is reused instead of queueing another one."""
+        release = threading.Event()
+        check = Mock(side_effect=lambda: release.wait(5))
+        
+        with patch.dict(payment_server_module._health_probes):
+            first = payment_server_module._submit_probe('slow', check)
+            second = payment_server_module._submit_probe('slow', check)
+            release.set()
+            first.result(timeout=5)
+            third = payment_server_module._submit_probe('slow', check)
+            third.result(timeout=5)
+        
+        assert second is first
+        assert third is not first
+        assert check.call_count == 2
+
+
 class TestRateLimiting:
     """Test rate limiting functionality."""
     
+    @pytest.mark.unit
+    @pytest.mark.api
+    def test_every_rate_limited_request_is_logged(self, payment_server_module):
+        """Test 429s are logged one by one under the default sample rate."""
+        module = payment_server_module
+        
+        with module.app.test_request_context(), patch.object(module.logger, 'warning') as warning:
+            for _ in range(3):
+                response = module.handle_rate_limit_error(None)
+        
+        assert response.status_code == 429
+        assert warning.call_count == 3
+    
     @pytest.mark.unit
     @pytest.mark.api
     @pytest.mark.security
@@ -0,0 +1,175 @@
+# Gotcha Guardian Payment Server - Database Tests
+# Test DatabaseManager queries against a real SQLite file
+
+import pytest
+from unittest.mock import patch
+
+
+@pytest.fixture(params=[True, False], ids=['returning', 'fallback'])
+def sql_path(request):
+    """Run a test on the UPDATE ... RETURNING path and on the SQLite < 3.35 fallback."""
+    with patch('src.models.database._HAS_RETURNING', request.param):
+        yield request.param
+
+
+def _add_purchases(database, count, status='pending'):
+    """Insert `count` purchases in one burst, so their purchase_date values collide."""
+    return [
+        database.create_purchase(f"buyer{i}@example.com", 'basic', 9.99, f"PAY-{i}", status)
+        for i in range(count)
+    ]
+
+
+class TestPurchasesPage:
+    """Test keyset pagination of the purchase listing."""
+
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_pages_cover_every_row_once(self, database):
+        """Test paging with equal timestamps neither skips nor repeats a row."""
+        ids = _add_purchases(database, 7)
+
+        seen = []
+        before_id = None
+        while True:
+            page = database.get_purchases_page(limit=3, before_id=before_id)
+            seen.extend(row['id'] for row in page)
+            if len(page) < 3:
+                break
+            before_id = page[-1]['id']
+
+        assert seen == sorted(ids, reverse=True)
+        assert database.count_purchases() == 7
+
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_page_masks_email(self, database):
+        """Test listed purchases never carry the full email address."""
+        _add_purchases(database, 1)
+
+        row = database.get_purchases_page(limit=1)[0]
+
+        assert row['email'] == 'buy***xample.com'
+        assert 'paypal_payment_id' not in row
+
+
+def _add_completed_purchase(database, activation_key, paypal_payment_id='PAY-DL'):
+    """Insert a purchase and complete it with the given activation key."""
+    database.create_purchase('buyer@example.com', 'basic', 9.99, paypal_payment_id)
+    assert database.complete_purchase(paypal_payment_id, 'basic', activation_key)
+
+
+class TestClaimDownload:
+    """Test the atomic download-limit check."""
+
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_limit_enforced_at_max_attempts(self, database, test_config, sql_path):
+        """Test exactly MAX_DOWNLOAD_ATTEMPTS downloads are granted."""
+        _add_completed_purchase(database, 'BASIC-20240101-AAAAAAAAAAAA')
+        max_attempts = test_config.MAX_DOWNLOAD_ATTEMPTS
+
+        claims = [
+            database.claim_download('BASIC-20240101-AAAAAAAAAAAA', max_attempts)
+            for _ in range(max_attempts + 2)
+        ]
+
+        assert [claim['download_count'] for claim in claims[:max_attempts]] == list(range(1, max_attempts + 1))
+        assert claims[max_attempts:] == [None, None]
+        purchase = database.get_purchase_by_activation_key('BASIC-20240101-AAAAAAAAAAAA')
+        assert purchase['download_count'] == max_attempts
+
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_unknown_key_returns_none(self, database, sql_path):
+        """Test an activation key with no purchase is never claimed."""
+        assert database.claim_download('BASIC-20240101-UNKNOWNUNKNO', 5) is None
+
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_incomplete_purchase_returns_none(self, database, sql_path):
+        """Test a purchase that is not completed cannot be downloaded."""
+        database.create_purchase('buyer@example.com', 'basic', 9.99, 'PAY-PENDING')
+        database.update_purchase_status('PAY-PENDING', 'pending', 'BASIC-20240101-PENDINGPENDI')
+
+        assert database.claim_download('BASIC-20240101-PENDINGPENDI', 5) is None
+
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_claim_returns_purchase_details(self, database, sql_path):
+        """Test a claim returns what the download route needs."""
+        _add_completed_purchase(database, 'BASIC-20240101-BBBBBBBBBBBB')
+
+        claim = database.claim_download('BASIC-20240101-BBBBBBBBBBBB', 5)
+
+        assert claim['product_id'] == 'basic'
+        assert claim['email'] == 'buyer@example.com'
+        assert claim['download_filename']
+
+
+class TestActivationKeyPool:
+    """Test handing out pre-generated activation keys."""
+
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_claims_never_share_a_key(self, database, sql_path):
+        """Test every claim takes a different key until the pool is empty."""
+        keys = [f"BASIC-20240101-{i:012d}" for i in range(5)]
+        assert database.create_activation_keys('basic', keys) == 5
+
+        claimed = [database.claim_activation_key('basic') for _ in range(6)]
+
+        assert sorted(claimed[:5]) == sorted(keys)
+        assert claimed[5] is None
+        assert database.count_unused_activation_keys('basic') == 0
+
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_concurrent_claims_never_share_a_key(self, database, sql_path):
+        """Test claims racing from several threads still get distinct keys."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        keys = [f"BASIC-20240101-{i:012d}" for i in range(40)]
+        database.create_activation_keys('basic', keys)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            claimed = list(pool.map(lambda _: database.claim_activation_key('basic'), range(40)))
+
+        assert sorted(claimed) == sorted(keys)
+
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_claims_are_per_product(self, database, sql_path):
+        """Test a product never receives another product's key."""
+        database.create_activation_keys('premium', ['PREMIUM-20240101-AAAAAAAAAAAA'])
+
+        assert database.claim_activation_key('basic') is None
+        assert database.claim_activation_key('premium') == 'PREMIUM-20240101-AAAAAAAAAAAA'
+
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_batch_with_duplicate_inserts_nothing(self, database):
+        """Test a failing batch is rolled back as a whole."""
+        database.create_activation_keys('basic', ['BASIC-20240101-AAAAAAAAAAAA'])
+
+        added = database.create_activation_keys(
+            'basic', ['BASIC-20240101-BBBBBBBBBBBB', 'BASIC-20240101-AAAAAAAAAAAA']
+        )
+
+        assert added == 0
+        assert database.count_unused_activation_keys('basic') == 1
+
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_concurrent_top_ups_fill_the_pool_once(self, database):
+        """Test workers topping up together never overfill the pool."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        def top_up(worker):
+            return database.top_up_activation_keys('basic', [f"W{worker}S{i:010d}" for i in range(10)])
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            added = list(pool.map(top_up, range(4)))
+
+        assert sum(added) == 10
+        assert database.count_unused_activation_keys('basic') == 10
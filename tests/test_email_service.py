@@ -0,0 +1,51 @@
+# Gotcha Guardian Payment Server - Email Service Tests
+# Test the SMTP health probe against a mocked smtplib
+
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from src.services.email_service import EmailService
+
+
+class TestCheckConnection:
+    """Test that health checks never stand in the way of sends."""
+
+    @pytest.fixture
+    def service(self, test_config):
+        """An email service pointed at the test SMTP settings."""
+        return EmailService(test_config)
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize('succeeded', [True, False])
+    def test_recent_send_is_reported_without_probing(self, service, succeeded):
+        """Test the outcome of a recent send answers the check with no connection."""
+        service._last_send = (time.monotonic(), succeeded)
+
+        with patch('src.services.email_service.smtplib.SMTP') as smtp:
+            assert service.check_connection() is succeeded
+
+        smtp.assert_not_called()
+
+    @pytest.mark.unit
+    def test_probe_does_not_wait_for_a_send(self, service):
+        """Test a probe runs on its own short-timeout connection while a send holds the session."""
+        results = []
+
+        with patch('src.services.email_service.smtplib.SMTP') as smtp, service._smtp_lock:
+            probe = threading.Thread(target=lambda: results.append(service.check_connection()))
+            probe.start()
+            probe.join(timeout=2)
+
+        assert results == [True]
+        smtp.assert_called_once_with('localhost', 587, timeout=service.SMTP_PROBE_TIMEOUT_SECONDS)
+        smtp.return_value.noop.assert_called_once()
+        assert service._smtp is None
+
+    @pytest.mark.unit
+    def test_unreachable_server_is_reported(self, service):
+        """Test a probe that cannot connect reports the service as down."""
+        with patch('src.services.email_service.smtplib.SMTP', side_effect=OSError("connection refused")):
+            assert service.check_connection() is False
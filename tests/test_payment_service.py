@@ -0,0 +1,157 @@
+# Gotcha Guardian Payment Server - Payment Service Tests
+# Test PayPal payment execution against a real database and a mocked SDK
+
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+import pytest
+
+from src.services.payment_service import PaymentService
+from src.validators.utils import validate_activation_key
+
+
+class _PurchaseDay(datetime):
+    """A fixed clock for the key generator, so the expected date never crosses midnight."""
+
+    @classmethod
+    def now(cls, tz=None):
+        return datetime(2031, 1, 1, 23, 59, 59)
+
+
+def _paypal_payment(sku='basic'):
+    """A PayPal payment as returned by Payment.find, already approved by the buyer."""
+    sale = SimpleNamespace(id='SALE-1')
+    transaction = SimpleNamespace(
+        item_list=SimpleNamespace(items=[SimpleNamespace(sku=sku)]),
+        related_resources=[SimpleNamespace(sale=sale)]
+    )
+    payment = Mock(transactions=[transaction], error=None)
+    payment.execute.return_value = True
+    return payment
+
+
+class TestExecutePayment:
+    """Test what a purchase is left as when executing its payment fails."""
+
+    @pytest.fixture
+    def service(self, test_config, database):
+        """A payment service whose PayPal SDK is a mock."""
+        service = PaymentService(test_config, database)
+        service._sdk = Mock()
+        database.create_purchase('buyer@example.com', 'basic', 9.99, 'PAY-1')
+        return service
+
+    def _status(self, database):
+        return database.get_purchase_by_paypal_id('PAY-1')['status']
+
+    @pytest.mark.unit
+    @pytest.mark.payment
+    def test_success_completes_purchase(self, service, database):
+        """Test an executed payment completes the purchase with a key."""
+        service._sdk.Payment.find.return_value = _paypal_payment()
+
+        result = service.execute_payment('PAY-1', 'PAYER-1')
+
+        assert result['success'] is True
+        assert result['transaction_id'] == 'SALE-1'
+        assert self._status(database) == 'completed'
+
+    @pytest.mark.unit
+    @pytest.mark.payment
+    def test_malformed_payment_is_not_charged(self, service, database):
+        """Test a payment without an item list is rejected before PayPal charges it."""
+        payment = _paypal_payment()
+        payment.transactions[0] = SimpleNamespace(related_resources=[])
+        service._sdk.Payment.find.return_value = payment
+
+        result = service.execute_payment('PAY-1', 'PAYER-1')
+
+        assert result['success'] is False
+        payment.execute.assert_not_called()
+        assert self._status(database) == 'failed'
+
+    @pytest.mark.unit
+    @pytest.mark.payment
+    def test_mismatched_product_is_not_charged(self, service, database):
+        """Test a payment for another product than the purchase is rejected before charging."""
+        payment = _paypal_payment(sku='premium')
+        service._sdk.Payment.find.return_value = payment
+
+        result = service.execute_payment('PAY-1', 'PAYER-1')
+
+        assert result['success'] is False
+        payment.execute.assert_not_called()
+        assert self._status(database) == 'failed'
+
+    @pytest.mark.unit
+    @pytest.mark.payment
+    def test_failure_after_charge_needs_review(self, service, database):
+        """Test a charged payment whose purchase cannot be completed is kept for review."""
+        service._sdk.Payment.find.return_value = _paypal_payment()
+
+        with patch.object(database, 'complete_purchase', side_effect=Exception("database is locked")):
+            result = service.execute_payment('PAY-1', 'PAYER-1')
+
+        assert result['success'] is False
+        assert self._status(database) == 'pending_review'
+
+    @pytest.mark.unit
+    @pytest.mark.payment
+    def test_retry_keeps_charged_purchase_for_review(self, service, database):
+        """Test a retry that PayPal refuses as already executed does not write off the charge."""
+        payment = _paypal_payment()
+        payment.execute.side_effect = ConnectionError("connection reset")
+        service._sdk.Payment.find.return_value = payment
+        service.execute_payment('PAY-1', 'PAYER-1')
+        assert self._status(database) == 'pending_review'
+
+        payment.execute.side_effect = None
+        payment.execute.return_value = False
+        result = service.execute_payment('PAY-1', 'PAYER-1')
+
+        assert result['success'] is False
+        assert self._status(database) == 'pending_review'
+
+    @pytest.mark.unit
+    @pytest.mark.payment
+    def test_completed_purchase_is_never_downgraded(self, service, database):
+        """Test replaying an executed payment leaves the completed purchase alone."""
+        service._sdk.Payment.find.return_value = _paypal_payment()
+        service.execute_payment('PAY-1', 'PAYER-1')
+
+        result = service.execute_payment('PAY-1', 'PAYER-1')
+
+        assert result['success'] is False
+        assert self._status(database) == 'completed'
+
+
+class TestActivationKeyPool:
+    """Test keys handed out from the pre-generated pool."""
+
+    @pytest.mark.unit
+    @pytest.mark.payment
+    def test_pool_is_filled_once(self, test_config, database):
+        """Test a second worker starting up adds no keys."""
+        first = PaymentService(test_config, database).refill_activation_keys('basic')
+        second = PaymentService(test_config, database).refill_activation_keys('basic')
+
+        assert first == PaymentService.ACTIVATION_KEY_POOL_SIZE
+        assert second == 0
+
+    @pytest.mark.unit
+    @pytest.mark.payment
+    def test_pooled_key_is_dated_when_claimed(self, test_config, database):
+        """Test a key from the pool carries the purchase date, not the refill date."""
+        service = PaymentService(test_config, database)
+        database.create_activation_keys('basic', ['AAAAAAAAAAAA', 'BASIC-20200101-BBBBBBBBBBBB'])
+
+        with patch('src.validators.utils.datetime', _PurchaseDay):
+            keys = [service._generate_activation_key('basic') for _ in range(2)]
+
+        for key, suffix in zip(keys, ['AAAAAAAAAAAA', 'BBBBBBBBBBBB']):
+            info = validate_activation_key(key)
+            assert info['valid']
+            assert info['product'] == 'BASIC'
+            assert info['date'] == datetime(2031, 1, 1)
+            assert info['unique_id'] == suffix
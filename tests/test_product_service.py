@@ -0,0 +1,65 @@
+# Gotcha Guardian Payment Server - Product Service Tests
+# Test the download archives built by ProductService
+
+import io
+import os
+import zipfile
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+
+from src.services.product_service import ProductService
+
+
+class _Later(datetime):
+    """A clock running years ahead, standing in for a worker started later."""
+
+    @classmethod
+    def now(cls, tz=None):
+        return datetime(2031, 1, 1, 12, 0, 0)
+
+
+class TestProductArchive:
+    """Test per-key download archives."""
+
+    @pytest.fixture
+    def product_files(self, temp_dir, monkeypatch):
+        """Product files on disk, with the service's download directory kept in temp_dir."""
+        monkeypatch.chdir(temp_dir)
+        files = []
+        for arcname, data in (('gotcha_guardian_basic.zip', b'PK\x05\x06' + b'\0' * 18),
+                              ('manual.txt', b'Gotcha Guardian manual\n' * 200)):
+            path = os.path.join(temp_dir, arcname)
+            with open(path, 'wb') as f:
+                f.write(data)
+            files.append((path, arcname))
+        return files
+
+    @pytest.mark.unit
+    def test_archive_identical_across_workers(self, test_config, product_files):
+        """Test two services built at different times serve the same bytes and ETag."""
+        first = ProductService(test_config, None).build_product_zip(
+            'gotcha_guardian_basic', 'GOTCHA_GUARDIAN_BASIC-20240101-AAAAAAAAAAAA', product_files
+        )
+        with patch('src.services.product_service.datetime', _Later):
+            second = ProductService(test_config, None).build_product_zip(
+                'gotcha_guardian_basic', 'GOTCHA_GUARDIAN_BASIC-20240101-AAAAAAAAAAAA', product_files
+            )
+
+        assert b''.join(first[0]) == b''.join(second[0])
+        assert first[1] == second[1]
+
+    @pytest.mark.unit
+    def test_archive_is_valid_and_personalized(self, test_config, product_files):
+        """Test the archive opens and carries this key's license."""
+        chunks, _ = ProductService(test_config, None).build_product_zip(
+            'gotcha_guardian_basic', 'GOTCHA_GUARDIAN_BASIC-20240101-AAAAAAAAAAAA', product_files
+        )
+
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            assert archive.testzip() is None
+            assert archive.namelist() == ['gotcha_guardian_basic.zip', 'manual.txt', 'README.txt', 'LICENSE.txt']
+            assert archive.getinfo('gotcha_guardian_basic.zip').compress_type == zipfile.ZIP_STORED
+            assert archive.getinfo('manual.txt').compress_type == zipfile.ZIP_DEFLATED
+            assert b'GOTCHA_GUARDIAN_BASIC-20240101-AAAAAAAAAAAA' in archive.read('LICENSE.txt')